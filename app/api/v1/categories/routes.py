@@ -1,5 +1,5 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from datetime import datetime
 from bson import ObjectId
 
@@ -7,6 +7,7 @@ from app.core.security import get_current_user
 from app.db.database import db
 from app.db.models import UserRole
 from app.schemas.category import CategoryOut, CategoryCreate, CategoryUpdate, CategoryTree
+from app.libs.category_utils import category_index
 
 router = APIRouter(tags=["categories"], prefix="/categories")
 
@@ -38,6 +39,7 @@ async def create_category(
     new_category["is_active"] = True
     
     result = await db.categories.insert_one(new_category)
+    category_index.invalidate()
     created_category = await db.categories.find_one({"_id": result.inserted_id})
     created_category["_id"] = str(created_category["_id"])
     if created_category.get("parent_id"):
@@ -56,33 +58,18 @@ async def list_categories(current_user = Depends(get_current_user)):
     return categories
 
 @router.get("/tree", response_model=List[CategoryTree])
-async def get_category_tree():
-    # Get all categories
-    categories = await db.categories.find({"is_active": True}).to_list(1000)
-    
-    # Create a mapping of id -> category
-    category_map = {str(category["_id"]): dict(category) for category in categories}
-    
-    # Convert ObjectId to string for parent_id
-    for category in category_map.values():
-        if category.get("parent_id"):
-            category["parent_id"] = str(category["parent_id"])
-    
-    # Find root categories and build tree
-    root_categories = []
-    for category_id, category in category_map.items():
-        if not category.get("parent_id"):
-            category["subcategories"] = []
-            root_categories.append(category)
-        else:
-            parent_id = category["parent_id"]
-            if parent_id in category_map:
-                if "subcategories" not in category_map[parent_id]:
-                    category_map[parent_id]["subcategories"] = []
-                category["subcategories"] = []
-                category_map[parent_id]["subcategories"].append(category)
-    
-    return root_categories
+async def get_category_tree(if_none_match: Optional[str] = Header(None)):
+    # Serve the pre-encoded tree from the category index
+    await category_index.ensure_loaded(db)
+    body, etag = category_index.tree_json()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if if_none_match:
+        client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/{category_id}", response_model=CategoryOut)
 async def get_category(category_id: str):
@@ -127,6 +114,7 @@ async def update_category(
             {"_id": ObjectId(category_id)},
             {"$set": update_data}
         )
+        category_index.invalidate()
     
     updated_category = await db.categories.find_one({"_id": ObjectId(category_id)})
     updated_category["_id"] = str(updated_category["_id"])
@@ -153,6 +141,7 @@ async def delete_category(
     await db.categories.delete_one(
         {"_id": ObjectId(category_id)},
     )
+    category_index.invalidate()
     
     
     return None
@@ -180,6 +169,7 @@ async def toggle_category_status(
         {"_id": ObjectId(category_id)},
         {"$set": {"is_active": new_status, "updated_at": datetime.utcnow()}}
     )
+    category_index.invalidate()
     
     updated_category = await db.categories.find_one({"_id": ObjectId(category_id)})
     updated_category["_id"] = str(updated_category["_id"])
@@ -1,14 +1,17 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from datetime import datetime
 
 from app.core.security import get_current_user
 from app.db.database import db
 from app.db.models import UserRole
 from app.schemas.merchant import MerchantOut, MerchantCreate, MerchantUpdate
+from app.libs.pagination import NEXT_CURSOR_HEADER, apply_cursor, next_cursor
 from bson import ObjectId
 router = APIRouter(tags=["merchants"], prefix="/merchants")
 
+MERCHANT_SORT = [("_id", 1)]
+
 def to_str_id(merchant):
     if merchant is None:
         return None
@@ -89,8 +92,17 @@ async def update_merchant_profile(
     return to_str_id(updated_merchant)
 
 @router.get("")
-async def list_merchants():
-    merchants = await db.merchants.find({}).to_list(1000)
+async def list_merchants(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    merchants = await db.merchants.find(
+        apply_cursor({}, MERCHANT_SORT, cursor)
+    ).sort(MERCHANT_SORT).limit(limit).to_list(limit)
+    page_cursor = next_cursor(merchants, MERCHANT_SORT, limit)
+    if page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
     return [to_str_id(m) for m in merchants]
 
 @router.get("/{merchant_id}")
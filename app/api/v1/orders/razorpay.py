@@ -1,27 +1,47 @@
-from fastapi import APIRouter, HTTPException, status, Body
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, Response, status, Body, Header
 from app.core.config import settings
+from app.db.database import db
+from app.libs.idempotency import run_idempotent
 import razorpay
 
 router = APIRouter(tags=["razorpay"], prefix="/orders/razorpay")
 
 @router.post("/order")
-def create_razorpay_order(
+async def create_razorpay_order(
+    request: Request,
+    response: Response,
     amount: int = Body(..., embed=True),
     currency: str = Body("INR", embed=True),
-    receipt: str = Body(None, embed=True)
+    receipt: str = Body(None, embed=True),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
         raise HTTPException(status_code=500, detail="Razorpay credentials not configured.")
-    try:
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))  # type: ignore
-        options = {
-            "amount": amount,
-            "currency": currency,
-            "receipt": receipt or f"order_rcptid",
-            "payment_capture": 1,
-        }
-        print("creating order")
-        order = client.order.create(options)
-        return {"orderId": order["id"], "order": order}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Razorpay order creation failed: {str(e)}") 
\ No newline at end of file
+
+    async def create():
+        try:
+            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))  # type: ignore
+            options = {
+                "amount": amount,
+                "currency": currency,
+                "receipt": receipt or f"order_rcptid",
+                "payment_capture": 1,
+            }
+            # The Razorpay SDK is blocking; keep it off the event loop
+            order = await asyncio.to_thread(client.order.create, options)
+            return {"orderId": order["id"], "order": order}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Razorpay order creation failed: {str(e)}")
+
+    # Retries with the same Idempotency-Key get the first gateway order instead of a duplicate.
+    # The route is unauthenticated, so keys are scoped by the receipt or else the caller's address
+    if receipt:
+        scope = f"razorpay-order:receipt:{receipt}"
+    else:
+        scope = f"razorpay-order:client:{request.client.host if request.client else ''}"
+    return await run_idempotent(
+        db, scope, idempotency_key,
+        {"amount": amount, "currency": currency, "receipt": receipt}, create, response
+    )
@@ -1,78 +1,111 @@
 # app/api/v1/orders/routes.py
 from typing import List, Optional
 from uuid import uuid4
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status, Query
 from datetime import datetime
 
 from app.core.security import get_current_user
 from app.db.database import db
 from app.db.models import UserRole, OrderStatus
 from app.schemas.order import Order, OrderCreate, OrderUpdate
+from app.libs.pagination import NEXT_CURSOR_HEADER, apply_cursor, next_cursor
+from app.libs.stock import StockConflict, available_quantity
+from app.libs.reservations import ACTIVE, CONVERTED, cancel_reservation, convert_reservation, place_order, release_reservation
+from app.libs.stock_shards import attach_stock, is_sharded
+from app.libs.idempotency import run_idempotent
 from bson import ObjectId
 router = APIRouter(tags=["orders"], prefix="/orders")
 
+ORDER_SORT = [("created_at", -1), ("_id", -1)]
+
+# Status changes an order may go through; cancelled and delivered orders are final
+ORDER_TRANSITIONS = {
+    OrderStatus.PENDING: {OrderStatus.PAID, OrderStatus.SHIPPED, OrderStatus.DELIVERED, OrderStatus.CANCELLED},
+    OrderStatus.PAID: {OrderStatus.SHIPPED, OrderStatus.DELIVERED, OrderStatus.CANCELLED},
+    OrderStatus.SHIPPED: {OrderStatus.DELIVERED},
+    OrderStatus.DELIVERED: set(),
+    OrderStatus.CANCELLED: set(),
+}
+# Moving a pending order to any of these takes its held stock off on-hand stock
+FULFILMENT_STATUSES = {OrderStatus.PAID, OrderStatus.SHIPPED, OrderStatus.DELIVERED}
+
 @router.post("")
 async def create_order(
     order_data: OrderCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     current_user = Depends(get_current_user)
 ):
-    # Validate items and calculate total
+    # Retries with the same Idempotency-Key get the first order back instead of a new one
+    return await run_idempotent(
+        db, f"orders:{current_user['_id']}", idempotency_key, order_data.model_dump(),
+        lambda: _create_order(order_data, current_user), response
+    )
+
+async def _create_order(order_data: OrderCreate, current_user):
+    # Merge repeated products so each one is validated and decremented once
+    quantities = {}
+    for item in order_data.items:
+        if item.quantity <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid quantity for product {item.product_id}"
+            )
+        product_id = ObjectId(item.product_id)
+        quantities[product_id] = quantities.get(product_id, 0) + item.quantity
+
+    # Load every product with one query, then validate and price in memory
+    products = {
+        product["_id"]: product
+        async for product in db.products.find({"_id": {"$in": list(quantities)}, "is_active": True})
+    }
+    sharded = {product_id: product["stock_shards"] for product_id, product in products.items() if is_sharded(product)}
+    await attach_stock(db, list(products.values()))
     total_amount = 0
     items = []
     merchant_ids = set()  # Track unique merchant IDs
-    
-    for item in order_data.items:
-        # Check if product exists and is active
-        product = await db.products.find_one({
-            "_id": ObjectId(item.product_id),
-            "is_active": True
-        })
-        
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
         if not product:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Product {item.product_id} not found or inactive"
+                detail=f"Product {product_id} not found or inactive"
             )
-        
+
         merchant_ids.add(str(product["merchant_id"]))  # Add merchant ID
-        
-        # Check if enough stock
-        if product["stock_quantity"] < item.quantity:
+
+        # Check if enough stock is left after other checkouts' holds
+        if available_quantity(product) < quantity:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Not enough stock for product {product['name']}"
             )
-        
-        # Calculate item total
-        item_total = product["price"] * item.quantity
-        
-        # Add to items list
+
         items.append({
-            "product_id": item.product_id,
-            "quantity": item.quantity,
+            "product_id": str(product_id),
+            "product_name": product["name"],
+            "quantity": quantity,
             "price": product["price"],
             "merchant_id": str(product["merchant_id"])  # Add merchant ID to item
         })
-        
-        # Add to total
-        total_amount += item_total
-        
-        # Update product stock
-        await db.products.update_one(
-            {"_id": ObjectId(item.product_id)},
-            {"$inc": {"stock_quantity": -item.quantity}}
-        )
-    
+        total_amount += product["price"] * quantity
+
     if len(merchant_ids) != 1:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="All products in an order must be from the same merchant"
         )
 
+    # Names are stored with the order so reads need no lookups
+    merchant = await db.merchants.find_one({"_id": ObjectId(list(merchant_ids)[0])}, {"business_name": 1})
+
     # Create order
     new_order = {
+        "_id": ObjectId(),
         "user_id": ObjectId(current_user["_id"]),
+        "user_name": current_user.get("full_name", ""),
         "merchant_id": ObjectId(list(merchant_ids)[0]),  # Set merchant ID
+        "merchant_name": merchant.get("business_name", "") if merchant else "",
         "items": items,
         "total_amount": total_amount,
         "status": OrderStatus.PENDING,
@@ -82,8 +115,24 @@ async def create_order(
         "updated_at": datetime.utcnow()
     }
     
-    result = await db.orders.insert_one(new_order)
-    created_order = await db.orders.find_one({"_id": result.inserted_id})
+    # Stock is held for the order until it is paid, cancelled or the hold expires
+    try:
+        await place_order(db, quantities, new_order, sharded)
+    except StockConflict:
+        # Another order took the stock after validation; name a product that is now short
+        current = {p["_id"]: p for p in await attach_stock(
+            db, await db.products.find({"_id": {"$in": list(quantities)}}).to_list(None)
+        )}
+        short = next(
+            (current[pid] for pid, qty in quantities.items()
+             if pid in current and (available_quantity(current[pid]) < qty or not current[pid].get("is_active", True))),
+            None,
+        )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Not enough stock for product {short['name']}" if short else "Stock changed, please retry"
+        )
+    created_order = await db.orders.find_one({"_id": new_order["_id"]})
     created_order["_id"] = str(created_order["_id"])
     created_order["user_id"] = str(created_order["user_id"])
     created_order["merchant_id"] = str(created_order["merchant_id"])
@@ -91,9 +140,11 @@ async def create_order(
 
 @router.get("", response_model=List[Order])
 async def list_orders(
+    response: Response,
     status: Optional[str] = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user = Depends(get_current_user)
 ):
     # Build query
@@ -112,77 +163,14 @@ async def list_orders(
         query["merchant_id"] = ObjectId(merchant["_id"])
     # Admin can see all orders (no filter needed)
 
-    pipeline = [
-        {"$match": query},
-        {"$sort": {"created_at": -1}},
-        {"$skip": skip},
-        {"$limit": limit},
-        {"$lookup": {
-            "from": "merchants",
-            "localField": "merchant_id",
-            "foreignField": "_id",
-            "as": "merchant_info"
-        }},
-        {"$unwind": {"path": "$merchant_info", "preserveNullAndEmptyArrays": True}},
-        {"$lookup": {
-            "from": "users",
-            "localField": "user_id",
-            "foreignField": "_id",
-            "as": "user_info"
-        }},
-        {"$unwind": {"path": "$user_info", "preserveNullAndEmptyArrays": True}},
-        {"$addFields": {"merchant_name": "$merchant_info.business_name", "user_name": "$user_info.full_name"}},
-        {"$lookup": {
-            "from": "products",
-            "let": {"items": "$items"},
-            "pipeline": [
-                {"$match": {"$expr": {"$in": ["$_id", {"$map": {"input": "$$items", "as": "i", "in": {"$toObjectId": "$$i.product_id"}}}]}}},
-                {"$project": {"_id": 1, "name": 1}}
-            ],
-            "as": "products_info"
-        }},
-        {"$addFields": {
-            "items": {
-                "$map": {
-                    "input": "$items",
-                    "as": "item",
-                    "in": {
-                        "$mergeObjects": [
-                            "$$item",
-                            {
-                                "product_name": {
-                                    "$ifNull": [
-                                        {
-                                            "$arrayElemAt": [
-                                                {
-                                                    "$map": {
-                                                        "input": {
-                                                            "$filter": {
-                                                                "input": "$products_info",
-                                                                "as": "prod",
-                                                                "cond": {"$eq": ["$$prod._id", {"$toObjectId": "$$item.product_id"}]}
-                                                            }
-                                                        },
-                                                        "as": "prod",
-                                                        "in": "$$prod.name"
-                                                    }
-                                                },
-                                                0
-                                            ]
-                                        },
-                                        ""
-                                    ]
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-        }},
-        {"$project": {"merchant_info": 0, "products_info": 0, "user_info": 0}}
-    ]
-    cursor = db.orders.aggregate(pipeline)
-    orders = await cursor.to_list(length=limit)
+    # Names are snapshotted into the order when it is placed, so this is a plain indexed find
+    orders_cursor = db.orders.find(apply_cursor(query, ORDER_SORT, cursor)).sort(ORDER_SORT)
+    if not cursor:
+        orders_cursor = orders_cursor.skip(skip)
+    orders = await orders_cursor.limit(limit).to_list(length=limit)
+    page_cursor = next_cursor(orders, ORDER_SORT, limit)
+    if page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
     for order in orders:
         order["_id"] = str(order["_id"])
         order["user_id"] = str(order["user_id"])
@@ -197,77 +185,9 @@ async def get_order(
     order_id: str,
     current_user = Depends(get_current_user)
 ):
-    pipeline = [
-        {"$match": {"_id": ObjectId(order_id)}},
-        {"$lookup": {
-            "from": "merchants",
-            "localField": "merchant_id",
-            "foreignField": "_id",
-            "as": "merchant_info"
-        }},
-        {"$unwind": {"path": "$merchant_info", "preserveNullAndEmptyArrays": True}},
-        {"$lookup": {
-            "from": "users",
-            "localField": "user_id",
-            "foreignField": "_id",
-            "as": "user_info"
-        }},
-        {"$unwind": {"path": "$user_info", "preserveNullAndEmptyArrays": True}},
-        {"$addFields": {"merchant_name": "$merchant_info.business_name", "user_name": "$user_info.full_name"}},
-        {"$lookup": {
-            "from": "products",
-            "let": {"items": "$items"},
-            "pipeline": [
-                {"$match": {"$expr": {"$in": ["$_id", {"$map": {"input": "$$items", "as": "i", "in": {"$toObjectId": "$$i.product_id"}}}]}}},
-                {"$project": {"_id": 1, "name": 1}}
-            ],
-            "as": "products_info"
-        }},
-        {"$addFields": {
-            "items": {
-                "$map": {
-                    "input": "$items",
-                    "as": "item",
-                    "in": {
-                        "$mergeObjects": [
-                            "$$item",
-                            {
-                                "product_name": {
-                                    "$ifNull": [
-                                        {
-                                            "$arrayElemAt": [
-                                                {
-                                                    "$map": {
-                                                        "input": {
-                                                            "$filter": {
-                                                                "input": "$products_info",
-                                                                "as": "prod",
-                                                                "cond": {"$eq": ["$$prod._id", {"$toObjectId": "$$item.product_id"}]}
-                                                            }
-                                                        },
-                                                        "as": "prod",
-                                                        "in": "$$prod.name"
-                                                    }
-                                                },
-                                                0
-                                            ]
-                                        },
-                                        ""
-                                    ]
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-        }},
-        {"$project": {"merchant_info": 0, "products_info": 0, "user_info": 0}}
-    ]
-    cursor = db.orders.aggregate(pipeline)
-    order = await cursor.to_list(length=1)
+    order = await db.orders.find_one({"_id": ObjectId(order_id)})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    order = order[0]
     # Permission checks (same as before)
     if current_user["role"] != UserRole.ADMIN and ((order["user_id"])) != (current_user["_id"]):
         if current_user["role"] == UserRole.MERCHANT:
@@ -316,85 +236,58 @@ async def update_order(
     
     # Prepare update data
     update_data = {k: v for k, v in order_update.dict(exclude_unset=True).items()}
+
+    # A cancelled order, or one whose stock hold expired or was released, no longer has stock behind it
+    reservation = await db.reservations.find_one({"_id": order["_id"]}, {"status": 1})
+    if update_data and (
+        order["status"] == OrderStatus.CANCELLED or (reservation and reservation["status"] not in (ACTIVE, CONVERTED))
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order was cancelled or its stock hold expired"
+        )
+
+    new_status = update_data.get("status")
+    status_changed = new_status is not None and new_status != order["status"]
+    if status_changed and new_status not in ORDER_TRANSITIONS.get(order["status"], set()):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Order cannot move from {order['status']} to {new_status}"
+        )
+    # Fulfilment turns the checkout hold into a stock decrement; orders placed before
+    # reservations existed had their stock decremented at creation
+    converting = status_changed and order["status"] == OrderStatus.PENDING and new_status in FULFILMENT_STATUSES and reservation
     
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
-        await db.orders.update_one(
-            {"_id": ObjectId(order_id)},
+        # Conditional on the status read above, so a payment and a cancellation racing each
+        # other cannot both apply; the reservation is only settled by the update that matched
+        result = await db.orders.update_one(
+            {"_id": order["_id"], "status": order["status"]},
             {"$set": update_data}
         )
+        if not result.matched_count:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Order was changed meanwhile, please retry"
+            )
+        if converting and not await convert_reservation(db, order["_id"]):
+            # The hold expired after the check above; cancel the order as the sweeper would have
+            await db.orders.update_one(
+                {"_id": order["_id"], "status": new_status},
+                {"$set": {"status": OrderStatus.CANCELLED, "cancel_reason": "reservation_expired", "updated_at": datetime.utcnow()}}
+            )
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Order's stock hold expired, please place the order again"
+            )
+        # Cancellation gives the held stock back, or the sold units if the order was paid
+        if status_changed and new_status == OrderStatus.CANCELLED:
+            await cancel_reservation(db, order["_id"])
     
-    pipeline = [
-        {"$match": {"_id": ObjectId(order_id)}},
-        {"$lookup": {
-            "from": "merchants",
-            "localField": "merchant_id",
-            "foreignField": "_id",
-            "as": "merchant_info"
-        }},
-        {"$unwind": {"path": "$merchant_info", "preserveNullAndEmptyArrays": True}},
-        {"$lookup": {
-            "from": "users",
-            "localField": "user_id",
-            "foreignField": "_id",
-            "as": "user_info"
-        }},
-        {"$unwind": {"path": "$user_info", "preserveNullAndEmptyArrays": True}},
-        {"$addFields": {"merchant_name": "$merchant_info.business_name", "user_name": "$user_info.full_name"}},
-        {"$lookup": {
-            "from": "products",
-            "let": {"items": "$items"},
-            "pipeline": [
-                {"$match": {"$expr": {"$in": ["$_id", {"$map": {"input": "$$items", "as": "i", "in": {"$toObjectId": "$$i.product_id"}}}]}}},
-                {"$project": {"_id": 1, "name": 1}}
-            ],
-            "as": "products_info"
-        }},
-        {"$addFields": {
-            "items": {
-                "$map": {
-                    "input": "$items",
-                    "as": "item",
-                    "in": {
-                        "$mergeObjects": [
-                            "$$item",
-                            {
-                                "product_name": {
-                                    "$ifNull": [
-                                        {
-                                            "$arrayElemAt": [
-                                                {
-                                                    "$map": {
-                                                        "input": {
-                                                            "$filter": {
-                                                                "input": "$products_info",
-                                                                "as": "prod",
-                                                                "cond": {"$eq": ["$$prod._id", {"$toObjectId": "$$item.product_id"}]}
-                                                            }
-                                                        },
-                                                        "as": "prod",
-                                                        "in": "$$prod.name"
-                                                    }
-                                                },
-                                                0
-                                            ]
-                                        },
-                                        ""
-                                    ]
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-        }},
-        {"$project": {"merchant_info": 0, "products_info": 0, "user_info": 0}}
-    ]
-    cursor = db.orders.aggregate(pipeline)
-    updated_order = await cursor.to_list(length=1)
+    updated_order = await db.orders.find_one({"_id": ObjectId(order_id)})
     if not updated_order:
         raise HTTPException(status_code=404, detail="Order not found")
-    updated_order = updated_order[0]
     updated_order["_id"] = str(updated_order["_id"])
     updated_order["user_id"] = str(updated_order["user_id"])
     updated_order["merchant_id"] = str(updated_order["merchant_id"])
@@ -421,6 +314,7 @@ async def delete_order(
         {"_id": ObjectId(order_id)},
         {"$set": {"is_active": False, "deleted_at": datetime.utcnow()}}
     )
+    await release_reservation(db, order["_id"])
     return None
 
 @router.patch("/{order_id}/cancel", response_model=Order)
@@ -446,10 +340,16 @@ async def cancel_order(
             detail="Order can only be cancelled if it is in 'pending' state."
         )
 
-    await db.orders.update_one(
-        {"_id": ObjectId(order_id)},
+    result = await db.orders.update_one(
+        {"_id": order["_id"], "status": order["status"]},
         {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}}
     )
+    if not result.matched_count:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order was changed meanwhile, please retry"
+        )
+    await release_reservation(db, order["_id"])
     updated_order = await db.orders.find_one({"_id": ObjectId(order_id)})
     updated_order["_id"] = str(updated_order["_id"])
     updated_order["user_id"] = str(updated_order["user_id"])
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app.db.database import db
 from app.db.models import UserRole
 from app.schemas.review import ReviewCreate, ReviewOut, ReviewUpdate
 from app.core.security import get_current_user
 from fastapi.encoders import jsonable_encoder
 from datetime import datetime
+from app.libs.review_utils import review_stats_inc
 
 router = APIRouter(tags=["reviews"], prefix="/products/{product_id}/reviews")
 
@@ -33,6 +35,10 @@ async def create_review(
     review_data["created_at"] = datetime.utcnow()
     review_data["updated_at"] = datetime.utcnow()
     result = await db.reviews.insert_one(review_data)
+    await db.products.update_one(
+        {"_id": ObjectId(product_id)},
+        {"$inc": review_stats_inc(review_data["rating"])}
+    )
     created = await db.reviews.find_one({"_id": result.inserted_id})
     created["_id"] = str(created["_id"])
     created["product_id"] = str(created["product_id"])
@@ -88,7 +94,24 @@ async def update_review(
     update_data = {k: v for k, v in review_update.dict(exclude_unset=True).items()}
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
-        await db.reviews.update_one({"_id": ObjectId(review_id)}, {"$set": update_data})
+        # The counter delta comes from the pre-image of this very update, so concurrent
+        # edits each move the review from the rating the other one left behind
+        before = await db.reviews.find_one_and_update(
+            {"_id": ObjectId(review_id)}, {"$set": update_data}, return_document=ReturnDocument.BEFORE
+        )
+        if not before:
+            raise HTTPException(status_code=404, detail="Review not found.")
+        new_rating = update_data.get("rating")
+        if new_rating is not None and new_rating != before["rating"]:
+            # Move the review from its old star bucket to the new one
+            await db.products.update_one(
+                {"_id": ObjectId(product_id)},
+                {"$inc": {
+                    "rating_sum": new_rating - before["rating"],
+                    f"rating_histogram.{before['rating']}": -1,
+                    f"rating_histogram.{new_rating}": 1,
+                }}
+            )
     updated = await db.reviews.find_one({"_id": ObjectId(review_id)})
     updated["_id"] = str(updated["_id"])
     updated["product_id"] = str(updated["product_id"])
@@ -109,5 +132,10 @@ async def delete_review(
         raise HTTPException(status_code=404, detail="Review not found.")
     if str(review["user_id"]) != str(current_user["_id"]) and current_user["role"] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Not enough permissions.")
-    await db.reviews.delete_one({"_id": ObjectId(review_id)})
+    result = await db.reviews.delete_one({"_id": ObjectId(review_id)})
+    if result.deleted_count:
+        await db.products.update_one(
+            {"_id": ObjectId(product_id)},
+            {"$inc": review_stats_inc(review["rating"], -1)}
+        )
     return None 
\ No newline at end of file
@@ -1,9 +1,10 @@
 # app/api/v1/products/routes.py (continued)
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, UploadFile, status, Query
 from datetime import datetime
 from bson import ObjectId
 
+from app.core.config import settings
 from app.core.security import get_current_user
 from app.db.database import db
 from app.db.models import UserRole
@@ -12,13 +13,24 @@ import json
 from fastapi.encoders import jsonable_encoder
 router = APIRouter(tags=["products"], prefix="/products")
 from fastapi.responses import ORJSONResponse
-from app.libs.chromadb import add_image,search_image, embedding_function, collection
-import numpy as np
-from PIL import Image
-import io
-import requests
+from app.libs.image_embeddings import embed_image_bytes
 from fastapi.logger import logger
 from app.libs.category_utils import get_descendant_category_ids
+from app.libs.review_utils import attach_review_stats, empty_review_stats
+from app.libs.pagination import NEXT_CURSOR_HEADER, apply_cursor, next_cursor
+from app.libs.related_products import claim_related_refresh, hydrate_related_products, refresh_related_products
+from app.libs.indexing import DELETE, UPSERT, enqueue_index_job
+from app.libs.category_matcher import category_matcher
+from app.libs.vector_search import vector_where
+from app.libs.hybrid_search import hybrid_rank, hydrate_page, search_candidates
+from app.libs.facets import count_facets, parse_facets
+from app.libs.suggest import suggest_index
+from app.libs.stock import HIDDEN_PRODUCT_FIELDS, StockConflict
+from app.libs.stock_shards import adjust_sharded_stock, attach_stock, is_sharded
+
+PRODUCT_SORT = [("_id", 1)]
+# Product fields that feed the image embedding or its metadata
+INDEXED_FIELDS = ("images", "price", "category_id", "is_active")
 
 @router.post("", response_model=ProductOut)
 async def create_product(
@@ -60,19 +72,17 @@ async def create_product(
     new_product["merchant_id"] = merchant["_id"]
     new_product["category_id"] = ObjectId(new_product["category_id"])
     new_product["is_active"] = True
-
-    
+    new_product.update(empty_review_stats())
+    new_product["created_at"] = datetime.utcnow()
+    new_product["updated_at"] = datetime.utcnow()
     
     result = await db.products.insert_one(new_product)
-    created_product = await db.products.find_one({"_id": result.inserted_id})
+    created_product = await db.products.find_one({"_id": result.inserted_id}, HIDDEN_PRODUCT_FIELDS)
 
-    image = product_data.images[0]
-    metadata = {
-        "category_id":product_data.category_id,
-        "price":product_data.price,
-        "_id":str(result.inserted_id)
-    }
-    add_image(str(result.inserted_id),image,metadata)
+    # Image embedding happens in the indexing workers
+    await enqueue_index_job(db, result.inserted_id, UPSERT)
+    suggest_index.upsert_product(created_product)
+    await attach_stock(db, [created_product])
     created_product["_id"] = str(created_product["_id"])
     created_product["category_id"] = str(created_product["category_id"])
     created_product["merchant_id"] = str(created_product["merchant_id"])
@@ -86,10 +96,15 @@ async def list_products(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     skip: int = Query(0, ge=0),
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    facets: Optional[str] = Query(None, description="Comma separated: category, merchant, price")
 ):
+    facet_names = parse_facets(facets)
+    facet_counts = None
     query = {"is_active": True}
 
+    category_ids = None
     if category_id:
         # Get all descendant category IDs (including the selected one)
         category_ids = await get_descendant_category_ids(category_id, db)
@@ -98,29 +113,6 @@ async def list_products(
     if merchant_id:
         query["merchant_id"] = ObjectId(merchant_id)
 
-    # --- Semantic Search with ChromaDB ---
-    if search:
-        # 1. Semantic search with ChromaDB
-        search_emb = embedding_function([search])[0]
-        result = collection.query(query_embeddings=[search_emb], n_results=limit)
-        chromadb_ids = [ObjectId(_id) for _id in result["ids"][0]]
-
-        # query["_id"] = {"$in": chromadb_ids}
-        # 2. Keyword search filter
-        keyword_filter = {
-            "$or": [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"description": {"$regex": search, "$options": "i"}}
-            ]
-        }
-
-        # 3. Combine both filters: match either ChromaDB or keyword
-        query["$or"] = [
-            {"_id": {"$in": chromadb_ids}},
-            keyword_filter["$or"][0],
-            keyword_filter["$or"][1]
-        ]
-
     # Price filter
     if min_price is not None or max_price is not None:
         price_query = {}
@@ -130,10 +122,32 @@ async def list_products(
             price_query["$lte"] = max_price
         if price_query:
             query["price"] = price_query
-    
-    # Execute query
-    cursor = db.products.find(query).skip(skip).limit(limit)
-    products = await cursor.to_list(length=limit)
+
+    if search:
+        # Hybrid search: text index and vector retrievers fused by rank; pages by skip
+        if cursor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="cursor is not supported with search, page with skip instead"
+            )
+        where = vector_where(category_ids, min_price, max_price)
+        fused = await hybrid_rank(db, search, query, where, search_candidates(skip, limit))
+        products = await hydrate_page(db, fused[skip:skip + limit])
+        page_cursor = None
+        if facet_names:
+            # Facets describe every ranked match, not only this page
+            facet_counts = await count_facets(db, {"$and": [query, {"_id": {"$in": fused}}]}, facet_names)
+    else:
+        # Execute query (keyset pagination when a cursor is given)
+        products_cursor = db.products.find(apply_cursor(query, PRODUCT_SORT, cursor), HIDDEN_PRODUCT_FIELDS).sort(PRODUCT_SORT)
+        if not cursor:
+            products_cursor = products_cursor.skip(skip)
+        products = await products_cursor.limit(limit).to_list(length=limit)
+        page_cursor = next_cursor(products, PRODUCT_SORT, limit)
+        if facet_names:
+            # Counts over the whole filter; the page above comes from the sort index
+            facet_counts = await count_facets(db, query, facet_names)
+    await attach_stock(db, products)
     for product in products:
         if "_id" in product:
             product["_id"] = str(product["_id"])
@@ -142,79 +156,38 @@ async def list_products(
         if "merchant_id" in product:
             product["merchant_id"] = str(product["merchant_id"])
 
-        # --- Add average_rating and review_count ---
-        try:
-            review_agg = await db.reviews.aggregate([
-                {"$match": {"product_id": ObjectId(product["_id"])}},
-                {"$group": {
-                    "_id": "$product_id",
-                    "average_rating": {"$avg": "$rating"},
-                    "review_count": {"$sum": 1}
-                }}
-            ]).to_list(length=1)
-            if review_agg and isinstance(review_agg[0], dict):
-                avg = review_agg[0].get("average_rating")
-                product["average_rating"] = round(avg, 2) if avg is not None else None
-                product["review_count"] = review_agg[0].get("review_count", 0)
-            else:
-                product["average_rating"] = None
-                product["review_count"] = 0
-        except Exception as e:
-            product["average_rating"] = None
-            product["review_count"] = 0
-
-    print("got ressults")
+    # --- Add average_rating and review_count ---
+    attach_review_stats(products)
 
-    # After fetching products:
-    if search and products:
-        # Create a mapping from id to product
-        product_map = {str(product["_id"]): product for product in products}
-        # First, add products in chromadb_ids order
-        ordered_products = [product_map[str(_id)] for _id in chromadb_ids if str(_id) in product_map]
-        # Then, add the rest (keyword-only matches)
-        chromadb_id_set = set(str(_id) for _id in chromadb_ids)
-        ordered_products += [product for product in products if str(product["_id"]) not in chromadb_id_set]
-        products = ordered_products
+    headers = {NEXT_CURSOR_HEADER: page_cursor} if page_cursor else None
+    if facet_names:
+        return ORJSONResponse({"items": products, "facets": facet_counts}, headers=headers)
+    return ORJSONResponse(products, headers=headers)
 
-    return ORJSONResponse(products) 
+@router.get("/suggest")
+async def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20)
+):
+    # Served from the in-memory prefix index; no database or model call per keystroke
+    await suggest_index.ensure_loaded(db)
+    return ORJSONResponse(suggest_index.suggest(q, limit))
 
 @router.get("/{product_id}")
-async def get_product(product_id: str):
-    product = await db.products.find_one({"_id": ObjectId(product_id)})
+async def get_product(product_id: str, background_tasks: BackgroundTasks):
+    product = await db.products.find_one({"_id": ObjectId(product_id)}, HIDDEN_PRODUCT_FIELDS)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    image = io.BytesIO(requests.get(product["images"][0]).content)
-    image_array = np.array(Image.open(image))
-    related_products_ids = search_image(image_array,5)
-    related_products = [await db.products.find_one({"_id":ObjectId(_id)}) for _id in related_products_ids]
-       
+    await attach_stock(db, [product])
 
-    for sku in related_products:
-        sku["_id"] = str(sku["_id"])
-        sku["merchant_id"] = str(sku["merchant_id"])
-        sku["category_id"] = str(sku["category_id"])
-    product["related_products"] = related_products[1:5]
+    # Related products are precomputed; compute them after responding if this product has none yet
+    product["related_products"] = await hydrate_related_products(product, db)
+    if await claim_related_refresh(product, db):
+        background_tasks.add_task(refresh_related_products, product["_id"], db)
+    product.pop("related_product_ids", None)
 
     # Add average_rating and review_count
-    try:
-        review_agg = await db.reviews.aggregate([
-            {"$match": {"product_id": ObjectId(product["_id"])}},
-            {"$group": {
-                "_id": "$product_id",
-                "average_rating": {"$avg": "$rating"},
-                "review_count": {"$sum": 1}
-            }}
-        ]).to_list(length=1)
-        if review_agg and isinstance(review_agg[0], dict):
-            avg = review_agg[0].get("average_rating")
-            product["average_rating"] = round(avg, 2) if avg is not None else None
-            product["review_count"] = review_agg[0].get("review_count", 0)
-        else:
-            product["average_rating"] = None
-            product["review_count"] = 0
-    except Exception as e:
-        product["average_rating"] = None
-        product["review_count"] = 0
+    attach_review_stats([product])
 
     if "_id" in product:
         product["_id"] = str(product["_id"])
@@ -255,7 +228,17 @@ async def update_product(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Category not found"
             )
-        update_data["category_id"] = str(update_data["category_id"])
+        update_data["category_id"] = ObjectId(update_data["category_id"])
+
+    # Sharded stock is set on the shard counters, not on the product document
+    if is_sharded(product) and update_data.get("stock_quantity") is not None:
+        try:
+            await adjust_sharded_stock(db, product["_id"], product["stock_shards"], update_data.pop("stock_quantity"))
+        except StockConflict:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Stock cannot go below the quantity held by open checkouts"
+            )
     
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
@@ -263,8 +246,13 @@ async def update_product(
             {"_id": ObjectId(product_id)},
             {"$set": update_data}
         )
+        # Re-index when anything stored in the vector collection changed
+        if any(field in update_data for field in INDEXED_FIELDS):
+            await enqueue_index_job(db, product_id, UPSERT)
     
-    updated_product = await db.products.find_one({"_id": ObjectId(product_id)})
+    updated_product = await db.products.find_one({"_id": ObjectId(product_id)}, HIDDEN_PRODUCT_FIELDS)
+    await attach_stock(db, [updated_product])
+    suggest_index.upsert_product(updated_product)
     updated_product["_id"] = str(updated_product["_id"])
     updated_product["category_id"] = str(updated_product["category_id"])
     updated_product["merchant_id"] = str(updated_product["merchant_id"])
@@ -290,11 +278,12 @@ async def delete_product(
             )
     
     # Soft delete (set is_active to False)
-    collection.delete(ids=[product_id])
     await db.products.update_one(
         {"_id": ObjectId(product_id)},
         {"$set": {"is_active": False, "updated_at": datetime.utcnow()}}
     )
+    await enqueue_index_job(db, product_id, DELETE)
+    suggest_index.remove_product(product_id)
     
     return None
 
@@ -318,7 +307,8 @@ async def get_merchant_inventory(
         )
     
     # Get merchant products
-    products = await db.products.find({"merchant_id": merchant["_id"]},).to_list(1000)
+    products = await db.products.find({"merchant_id": merchant["_id"]}, HIDDEN_PRODUCT_FIELDS).to_list(1000)
+    await attach_stock(db, products)
     for product in products:
         product["_id"] = str(product["_id"])
         product["merchant_id"] = str(product["merchant_id"])
@@ -326,33 +316,34 @@ async def get_merchant_inventory(
     return products
 
 @router.post("/search/image")
-async def get_search_by_image(image: UploadFile):
+async def get_search_by_image(
+    image: UploadFile,
+    response: Response,
+    top_k: int = Query(3, ge=1, le=20),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
     # Read the image file
     image_data = await image.read()
-    pil_image = Image.open(io.BytesIO(image_data))
-    image_np = np.array(pil_image)
-
-    # 1. Compute image embedding
-    image_emb = embedding_function([image_np] )[0]
 
-    # 2. Fetch all categories and compute their text embeddings
-    categories = await db.categories.find({"is_active": True}).to_list(1000)
-    category_texts = [cat["name"] for cat in categories]
-    category_ids = [str(cat["_id"]) for cat in categories]
-    cat_embs = embedding_function(category_texts)
+    # 1. Compute image embedding, reusing the cached vector for a previously seen image
+    image_emb = await embed_image_bytes(db, image_data, ttl_seconds=settings.IMAGE_SEARCH_EMBEDDING_TTL_SECONDS)
 
-    # 3. Find closest category (cosine similarity)
-    def cosine_sim(a, b):
-        a = np.array(a)
-        b = np.array(b)
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    sims = [cosine_sim(image_emb, cat_emb) for cat_emb in cat_embs]
-    print("Sims",sims)
-    best_idx = int(np.argmax(sims))
-    best_category_id = category_ids[best_idx]
+    # 2. Rank categories against the cached category embedding matrix
+    categories = await category_matcher.top_k(image_emb, db, top_k)
+    if not categories:
+        raise HTTPException(status_code=404, detail="No categories to match against")
+    best_category_id = categories[0]["category_id"]
 
-    # 4. Return all products in that category
-    products = await db.products.find({"category_id": ObjectId(best_category_id), "is_active": True}).to_list(1000)
+    # 3. Return one page of products in the best matching category
+    query = {"category_id": ObjectId(best_category_id), "is_active": True}
+    products = await db.products.find(
+        apply_cursor(query, PRODUCT_SORT, cursor), HIDDEN_PRODUCT_FIELDS
+    ).sort(PRODUCT_SORT).limit(limit).to_list(limit)
+    page_cursor = next_cursor(products, PRODUCT_SORT, limit)
+    if page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
+    await attach_stock(db, products)
     for product in products:
         if "_id" in product:
             product["_id"] = str(product["_id"])
@@ -360,4 +351,4 @@ async def get_search_by_image(image: UploadFile):
             product["category_id"] = str(product["category_id"])
         if "merchant_id" in product:
             product["merchant_id"] = str(product["merchant_id"])
-    return {"category_id": best_category_id, "products": products}
\ No newline at end of file
+    return {"category_id": best_category_id, "categories": categories, "products": products}
@@ -1,14 +1,17 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from datetime import datetime
 from app.db.models import UserRole
 
 from app.core.security import get_current_user, get_password_hash
 from app.db.database import db
 from app.schemas.user import User, UserUpdate
+from app.libs.pagination import NEXT_CURSOR_HEADER, apply_cursor, next_cursor
 from bson import ObjectId
 router = APIRouter(tags=["users"], prefix="/users")
 
+USER_SORT = [("_id", 1)]
+
 @router.get("/me", )
 async def read_users_me(current_user = Depends(get_current_user)):
     current_user["_id"] = str(current_user["_id"])
@@ -46,13 +49,23 @@ async def get_user(user_id: str, current_user = Depends(get_current_user)):
     return user
 
 @router.get("", )
-async def list_users(current_user = Depends(get_current_user)):
+async def list_users(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user = Depends(get_current_user)
+):
     if current_user["role"] != UserRole.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    users = await db.users.find({"role":UserRole.USER}).to_list(1000)
+    users = await db.users.find(
+        apply_cursor({"role": UserRole.USER}, USER_SORT, cursor)
+    ).sort(USER_SORT).limit(limit).to_list(limit)
+    page_cursor = next_cursor(users, USER_SORT, limit)
+    if page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
     for user in users:
         if "_id" in user:
             user["_id"] = str(user["_id"])
@@ -16,6 +16,7 @@ class Settings(BaseSettings):
     # MongoDB settings
     MONGO_URI: str = os.getenv("MONGO_URI", "mongodb://localhost:27017")
     MONGO_DB: str = os.getenv("MONGO_DB", "ecommerce")
+    ENSURE_INDEXES_ON_STARTUP: bool = True
     CLOUDINARY_CLOUD_NAME: Optional[str] = os.getenv("CLOUDINARY_CLOUD_NAME")
     CLOUDINARY_API_KEY: Optional[str] = os.getenv("CLOUDINARY_API_KEY")
     CLOUDINARY_API_SECRET: Optional[str] = os.getenv("CLOUDINARY_API_SECRET")
@@ -25,6 +26,88 @@ class Settings(BaseSettings):
     LIVEKIT_API_KEY: Optional[str] = os.getenv("LIVEKIT_API_KEY")
     LIVEKIT_API_SECRET: Optional[str] = os.getenv("LIVEKIT_API_SECRET")
     LIVEKIT_URL: Optional[str] = os.getenv("LIVEKIT_URL")
+
+    # Vector store (Chroma + OpenCLIP)
+    CHROMA_PATH: str = "embeddings"
+    CHROMA_COLLECTION: str = "collections"
+    VECTOR_STORE_WARMUP: bool = True
+
+    # Semantic search: Chroma is asked for limit * overfetch neighbours, doubling up to the max when filters drop them
+    VECTOR_SEARCH_OVERFETCH: int = 2
+    VECTOR_SEARCH_MAX_RESULTS: int = 500
+
+    # Hybrid search: candidates taken from each retriever and the reciprocal-rank-fusion constant
+    HYBRID_SEARCH_CANDIDATES: int = 100
+    HYBRID_SEARCH_RRF_K: int = 60
+
+    # Embedding model: backend is "torch", "onnx" or "onnx-int8"; device is "cpu", "cuda", "mps" or "auto"
+    EMBEDDING_MODEL: str = "ViT-B-32"
+    EMBEDDING_CHECKPOINT: str = "laion2b_s34b_b79k"
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_DEVICE: str = "cpu"
+    EMBEDDING_THREADS: Optional[int] = None
+    EMBEDDING_ONNX_DIR: str = "models/openclip-onnx"
+
+    # Inference pool: calls beyond workers + queue size are rejected with 503
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_QUEUE_SIZE: int = 16
+    INFERENCE_TIMEOUT_SECONDS: float = 10.0
+
+    # Embedding micro-batching: flush at this many items or after this long
+    EMBEDDING_BATCH_MAX_SIZE: int = 16
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+
+    # Cached embeddings of search-by-image uploads expire; product image embeddings are kept
+    IMAGE_SEARCH_EMBEDDING_TTL_SECONDS: int = 24 * 60 * 60
+
+    # Search query embedding cache; set the path to persist it across restarts
+    QUERY_EMBEDDING_CACHE_SIZE: int = 10000
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    QUERY_EMBEDDING_CACHE_PATH: Optional[str] = None
+
+    # Precomputed related products; a refresh interval of 0 disables the background refresher
+    RELATED_PRODUCTS_COUNT: int = 4
+    RELATED_PRODUCTS_MAX_AGE_SECONDS: int = 24 * 60 * 60
+    RELATED_PRODUCTS_REFRESH_INTERVAL_SECONDS: int = 600
+    RELATED_PRODUCTS_REFRESH_BATCH: int = 100
+    RELATED_PRODUCTS_RETRY_SECONDS: int = 600
+
+    # Product indexing job queue (Mongo "index_jobs" collection); 0 workers disables consumption
+    INDEXING_WORKERS: int = 2
+    INDEXING_MAX_ATTEMPTS: int = 5
+    INDEXING_RETRY_BASE_SECONDS: int = 5
+    INDEXING_LEASE_SECONDS: int = 120
+    INDEXING_POLL_SECONDS: float = 2.0
+
+    # Catalog reindex (manage.py reindex)
+    REINDEX_BATCH_SIZE: int = 64
+    REINDEX_DOWNLOAD_CONCURRENCY: int = 16
+    REINDEX_DOWNLOAD_TIMEOUT_SECONDS: float = 20.0
+    REINDEX_BATCH_TIMEOUT_SECONDS: float = 300.0
+
+    # Checkout stock reservations: holds expire unless the order is paid; 0 disables the sweeper
+    RESERVATION_TTL_SECONDS: int = 15 * 60
+    RESERVATION_SWEEP_INTERVAL_SECONDS: int = 30
+    RESERVATION_SWEEP_BATCH: int = 200
+
+    # Sharded stock counters (opt-in per product via manage.py stock-shards); 0 disables rebalancing
+    STOCK_SHARD_REBALANCE_INTERVAL_SECONDS: int = 60
+
+    # Idempotency-Key records for order creation: kept for the TTL; a duplicate waits up to
+    # IDEMPOTENCY_WAIT_SECONDS for the first request, whose lock is taken over after IDEMPOTENCY_LOCK_SECONDS
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
+    IDEMPOTENCY_LOCK_SECONDS: int = 60
+
+    # Facet counts cached per filter signature
+    FACET_CACHE_SIZE: int = 1000
+    FACET_CACHE_TTL_SECONDS: int = 60
+
+    # Typeahead suggestions: full rebuild interval; routes on this worker update it immediately
+    SUGGEST_INDEX_TTL_SECONDS: int = 600
+
+    # Category hierarchy cache
+    CATEGORY_INDEX_TTL_SECONDS: int = 300
     class Config:
         case_sensitive = True
         env_file = ".env"
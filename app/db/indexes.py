@@ -0,0 +1,113 @@
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+# Declarative registry of the indexes the route queries rely on, keyed by collection.
+# Index names are derived by pymongo from the keys (e.g. "merchant_id_1").
+INDEXES = {
+    "products": [
+        IndexModel([("merchant_id", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("category_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("price", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("related_refreshed_at", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+        # Only sharded products carry stock_shards; the shard rebalancer scans for them
+        IndexModel([("stock_shards", ASCENDING)], sparse=True),
+        # Keyword retriever for hybrid search; a collection can only have one text index
+        IndexModel([("name", TEXT), ("description", TEXT)], weights={"name": 3, "description": 1}),
+    ],
+    "reviews": [
+        IndexModel([("product_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    ],
+    "orders": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("merchant_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "reservations": [
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)]),
+        # Closed reservations carry purge_at; active holds are released by the sweeper, never by TTL
+        IndexModel([("purge_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "stock_shards": [
+        IndexModel([("product_id", ASCENDING), ("shard", ASCENDING)]),
+    ],
+    "merchants": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("role", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "categories": [
+        IndexModel([("parent_id", ASCENDING)]),
+    ],
+    "index_jobs": [
+        IndexModel([("status", ASCENDING), ("next_run_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)]),
+        # Finished jobs are dropped after a week; dead-lettered jobs are kept
+        IndexModel([("done_at", ASCENDING)], expireAfterSeconds=7 * 24 * 60 * 60),
+    ],
+    "image_embeddings": [
+        # Only search-by-image query entries carry expires_at; product image entries are kept
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Options that make two indexes with the same keys behave differently
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "weights")
+
+def _normalize(spec):
+    key = [
+        (field, direction if isinstance(direction, str) else int(direction))
+        for field, direction in dict(spec["key"]).items()
+    ]
+    # The server reports text indexes as _fts/_ftsx keys; compare their fields through the weights
+    if any(direction == TEXT for _, direction in key) or "_fts" in dict(key):
+        key = [(field, TEXT) for field in sorted(spec.get("weights") or dict(key))]
+    options = {option: spec[option] for option in COMPARED_OPTIONS if option in spec}
+    return key, options
+
+async def ensure_indexes(db):
+    """
+    Create every index in the registry that does not exist yet.
+    Args:
+        db: The database instance.
+    Returns:
+        Dict[str, str]: Collection name -> error message, for collections whose indexes could not be built.
+    """
+    errors = {}
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            errors[collection_name] = str(e)
+    return errors
+
+async def index_report(db):
+    """
+    Compare the registry with the indexes that exist in the database.
+    Args:
+        db: The database instance.
+    Returns:
+        Dict[str, dict]: Collection name -> {"missing": [...], "extra": [...], "mismatched": [...]}
+        listing index names, for every collection that differs from the registry.
+    """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        existing.pop("_id_", None)
+        declared = {index.document["name"]: index.document for index in indexes}
+
+        missing = [name for name in declared if name not in existing]
+        extra = [name for name in existing if name not in declared]
+        mismatched = [
+            name for name in declared
+            if name in existing and _normalize(declared[name]) != _normalize(existing[name])
+        ]
+        if missing or extra or mismatched:
+            report[collection_name] = {"missing": missing, "extra": extra, "mismatched": mismatched}
+    return report
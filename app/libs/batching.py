@@ -0,0 +1,76 @@
+import asyncio
+import time
+from app.libs.metrics import histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent embedding requests into batched forward passes.
+    A batch is flushed when it reaches `max_batch_size` items or when its first
+    item has waited `max_wait_ms`, whichever comes first. Each batch takes a single
+    slot on the inference executor and results are fanned back out per request.
+    """
+
+    def __init__(self, embed, executor, max_batch_size, max_wait_ms, name="embedding"):
+        self.embed_fn = embed
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batch_sizes = histogram(f"{name}_batch_size", BATCH_SIZE_BUCKETS)
+        self.batch_latency = histogram(f"{name}_batch_latency_ms")
+        self.request_latency = histogram(f"{name}_request_latency_ms")
+
+    async def embed(self, item):
+        """Embed one text or image array, sharing a forward pass with concurrent callers."""
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        try:
+            return await future
+        finally:
+            self.request_latency.observe((time.perf_counter() - started) * 1000)
+
+    async def embed_many(self, items):
+        return await asyncio.gather(*(self.embed(item) for item in items))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        self.batch_sizes.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            embeddings = await self.executor.run(self.embed_fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.batch_latency.observe((time.perf_counter() - started) * 1000)
+        if len(embeddings) != len(batch):
+            error = ValueError("Embedding function returned a different number of embeddings than inputs")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
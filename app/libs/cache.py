@@ -0,0 +1,45 @@
+import time
+from collections import OrderedDict
+from app.libs.metrics import counter
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire `ttl_seconds` after they were set.
+    Used from the event loop only, so it needs no locking.
+    """
+
+    def __init__(self, max_size, ttl_seconds, name):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = counter(f"{name}_hits")
+        self.misses = counter(f"{name}_misses")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses.inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits.inc()
+        return entry[0]
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def items(self):
+        """Live entries, least recently used first."""
+        now = time.monotonic()
+        return [(key, value) for key, (value, expires_at) in self._entries.items() if expires_at >= now]
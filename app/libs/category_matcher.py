@@ -0,0 +1,74 @@
+import asyncio
+import numpy as np
+from app.libs.category_utils import category_index
+from app.libs.chromadb import embedding_batcher
+
+
+class CategoryMatcher:
+    """
+    L2-normalized text embeddings of the active category names, stacked into one matrix.
+    The matrix is rebuilt only when the category index changes, and names that were
+    embedded before are reused, so a rename costs one forward pass rather than all of them.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._name_embeddings = {}
+        self._ids = []
+        self._names = []
+        self._matrix = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure_matrix(self, db):
+        await category_index.ensure_loaded(db)
+        if self._version == category_index.version:
+            return
+        async with self._lock:
+            version = category_index.version
+            if self._version == version:
+                return
+            categories = [c for c in category_index.categories.values() if c.get("is_active", True) and c.get("name")]
+            names = [category["name"] for category in categories]
+
+            # Embedded one batch at a time so a large catalog never floods the inference queue
+            missing = [name for name in dict.fromkeys(names) if name not in self._name_embeddings]
+            chunk_size = embedding_batcher.max_batch_size
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start + chunk_size]
+                for name, embedding in zip(chunk, await embedding_batcher.embed_many(chunk)):
+                    self._name_embeddings[name] = np.asarray(embedding, dtype=np.float32)
+            self._name_embeddings = {name: self._name_embeddings[name] for name in names}
+
+            matrix = np.stack([self._name_embeddings[name] for name in names]) if names else np.zeros((0, 0), dtype=np.float32)
+            if len(names):
+                matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._ids = [str(category["_id"]) for category in categories]
+            self._names = names
+            self._matrix = matrix
+            self._version = version
+
+    async def top_k(self, embedding, db, k):
+        """
+        Rank the active categories by cosine similarity to an embedding.
+        Args:
+            embedding (Sequence[float]): Image (or text) embedding.
+            db: The database instance.
+            k (int): Number of categories to return.
+        Returns:
+            List[dict]: Up to k {"category_id", "name", "score"} dicts, best first.
+        """
+        await self._ensure_matrix(db)
+        if not self._ids:
+            return []
+        vector = np.asarray(embedding, dtype=np.float32)
+        scores = self._matrix @ (vector / np.linalg.norm(vector))
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {"category_id": self._ids[i], "name": self._names[i], "score": round(float(scores[i]), 4)}
+            for i in best
+        ]
+
+
+category_matcher = CategoryMatcher()
@@ -1,8 +1,113 @@
+import asyncio
+import hashlib
+import json
+import time
 from bson import ObjectId
+from app.core.config import settings
+
+class CategoryIndex:
+    """
+    Process-wide, in-memory copy of the category hierarchy.
+    It is loaded with a single query and marked stale by the category routes
+    whenever a category is created, updated, deleted or toggled. The TTL bounds
+    how long a worker can serve a hierarchy changed through another worker.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.categories = {}
+        self.children = {}
+        self.version = 0
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+        self._tree = None
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl_seconds
+
+    async def load(self, db):
+        categories = await db.categories.find({}).to_list(None)
+        children = {}
+        for category in categories:
+            parent_id = category.get("parent_id")
+            if parent_id:
+                children.setdefault(parent_id, []).append(category["_id"])
+        self.categories = {category["_id"]: category for category in categories}
+        self.children = children
+        self.loaded_at = time.monotonic()
+        self.version += 1
+
+    async def ensure_loaded(self, db):
+        if not self.is_stale():
+            return
+        async with self._lock:
+            # Another request may have reloaded while we waited for the lock
+            if self.is_stale():
+                await self.load(db)
+
+    def invalidate(self):
+        self.loaded_at = None
+        self.version += 1
+
+    def tree_json(self):
+        """
+        Return the active category tree as pre-encoded JSON and its strong ETag.
+        The encoding is cached until the index is next invalidated or reloaded.
+        """
+        if self._tree is None or self._tree[0] != self.version:
+            body = json.dumps(build_category_tree(self.categories.values()), separators=(",", ":")).encode()
+            etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            self._tree = (self.version, body, etag)
+        return self._tree[1], self._tree[2]
+
+    def descendants(self, category_id):
+        """Return the category and all of its descendants, walking the in-memory adjacency."""
+        all_ids = [category_id]
+        seen = {category_id}
+        stack = [category_id]
+        while stack:
+            for child_id in self.children.get(stack.pop(), ()):
+                # Guard against cycles introduced by parent_id updates
+                if child_id not in seen:
+                    seen.add(child_id)
+                    all_ids.append(child_id)
+                    stack.append(child_id)
+        return all_ids
+
+def build_category_tree(categories):
+    """
+    Nest active categories under their parents.
+    Args:
+        categories (Iterable[dict]): Category documents.
+    Returns:
+        List[dict]: Root categories, each with a recursive `subcategories` list.
+    """
+    category_map = {}
+    for category in categories:
+        if not category.get("is_active", True):
+            continue
+        category_map[str(category["_id"])] = {
+            "_id": str(category["_id"]),
+            "name": category.get("name"),
+            "description": category.get("description"),
+            "parent_id": str(category["parent_id"]) if category.get("parent_id") else None,
+            "is_active": True,
+            "subcategories": [],
+        }
+
+    root_categories = []
+    for category in category_map.values():
+        if not category["parent_id"]:
+            root_categories.append(category)
+        elif category["parent_id"] in category_map:
+            category_map[category["parent_id"]]["subcategories"].append(category)
+    return root_categories
+
+category_index = CategoryIndex(ttl_seconds=settings.CATEGORY_INDEX_TTL_SECONDS)
 
 async def get_descendant_category_ids(category_id, db):
     """
-    Recursively fetch all descendant category IDs (including the given one).
+    Fetch all descendant category IDs (including the given one) from the category index.
     Args:
         category_id (str or ObjectId): The root category ID.
         db: The database instance (should have a 'categories' collection).
@@ -11,13 +116,5 @@ async def get_descendant_category_ids(category_id, db):
     """
     if not isinstance(category_id, ObjectId):
         category_id = ObjectId(category_id)
-    all_ids = [category_id]
-    queue = [category_id]
-    while queue:
-        current_id = queue.pop(0)
-        children = await db.categories.find({"parent_id": current_id}).to_list(1000)
-        for child in children:
-            child_id = child["_id"]
-            all_ids.append(child_id)
-            queue.append(child_id)
-    return all_ids 
\ No newline at end of file
+    await category_index.ensure_loaded(db)
+    return category_index.descendants(category_id)
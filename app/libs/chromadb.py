@@ -1,50 +1,159 @@
-import chromadb
-import sys
-from chromadb.utils.embedding_functions import OpenCLIPEmbeddingFunction
-client = chromadb.PersistentClient(path="embeddings")
+import asyncio
+import os
+import threading
+import unicodedata
 import numpy
-from app.db.database import db
+from app.core.config import settings
+from app.libs.batching import EmbeddingBatcher
+from app.libs.cache import TTLCache
+from app.libs.inference import inference
 from PIL import Image
-import requests
 import io
-from chromadb.utils.embedding_functions import OpenCLIPEmbeddingFunction
-embedding_function = OpenCLIPEmbeddingFunction(device="mps" if sys.platform == "darwin" else "cuda")
-collection = client.get_or_create_collection(name="collections",embedding_function=embedding_function)
 
-def fetchImage(url):
-  response = requests.get(url)
 
-  return io.BytesIO(response.content)
-def add_image(id,url,metadata):
-  collection.add(ids=[id],images=[numpy.array(Image.open(fetchImage(url)))],metadatas=[metadata])
+class VectorStore:
+  """
+  OpenCLIP embedding function and Chroma collection, started on demand.
+  Importing this module is cheap: torch, open_clip and chromadb are only loaded
+  by `start()`, which the lifespan warmup runs in a background thread.
+  """
 
+  def __init__(self, path, collection_name):
+    self.path = path
+    self.collection_name = collection_name
+    self.error = None
+    self._lock = threading.Lock()
+    self._embedding_function = None
+    self._collection = None
 
+  @property
+  def ready(self):
+    return self._collection is not None
 
+  def start(self):
+    if self.ready:
+      return
+    with self._lock:
+      if self.ready:
+        return
+      try:
+        import chromadb
+        from app.libs.embeddings import create_embedding_function
 
-def search_image(image,n_results=100):
-  result =  collection.query(query_images=[image],n_results=n_results)
-  print(result)
-  return result["ids"][0]
+        embedding_function = create_embedding_function(settings)
+        client = chromadb.PersistentClient(path=self.path)
+        self._collection = client.get_or_create_collection(name=self.collection_name,embedding_function=embedding_function)
+        self._embedding_function = embedding_function
+        self.error = None
+      except Exception as e:
+        self.error = e
+        raise
+
+  async def ensure_started(self):
+    """Start the store without blocking the event loop; waits for an in-progress warmup."""
+    if not self.ready:
+      await asyncio.to_thread(self.start)
+
+  @property
+  def embedding_function(self):
+    self.start()
+    return self._embedding_function
+
+  @property
+  def collection(self):
+    self.start()
+    return self._collection
+
+
+vector_store = VectorStore(path=settings.CHROMA_PATH, collection_name=settings.CHROMA_COLLECTION)
+
+def embed(items):
+  return vector_store.embedding_function(items)
 
+# Request-path embeddings go through the batcher; it runs `embed` on the inference pool
+embedding_batcher = EmbeddingBatcher(
+  embed,
+  inference,
+  max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+  max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+)
 
+query_embedding_cache = TTLCache(
+  max_size=settings.QUERY_EMBEDDING_CACHE_SIZE,
+  ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+  name="query_embedding_cache",
+)
+_query_embeddings_in_flight = {}
 
-  
+def normalize_query(text):
+  return " ".join(unicodedata.normalize("NFKC", text).lower().split())
 
-async def update_metadata():
-  cursor = db.products.find({})
+async def embed_query(text):
+  """Embed a search query, reusing cached vectors for repeated (normalized) strings."""
+  key = normalize_query(text)
+  embedding = query_embedding_cache.get(key)
+  if embedding is not None:
+    return embedding
 
-  products = await cursor.to_list(None)
+  # Concurrent misses for the same query share one embedding
+  in_flight = _query_embeddings_in_flight.get(key)
+  if in_flight is not None:
+    return await asyncio.shield(in_flight)
+  in_flight = asyncio.ensure_future(embedding_batcher.embed(key))
+  _query_embeddings_in_flight[key] = in_flight
+  try:
+    embedding = await asyncio.shield(in_flight)
+  finally:
+    _query_embeddings_in_flight.pop(key, None)
+  query_embedding_cache.set(key, embedding)
+  return embedding
 
-  ids = [str(product["_id"]) for product in products]
-  images = [numpy.array(Image.open(fetchImage(product["images"][0]))) for product in products]
-  metadatas =  [
-    {
-  "_id": str(product["_id"]),
-  
-  "price":product["price"],
-  "category_id": product["category_id"]
-}
-  for product in products]
+def embedding_model_tag():
+  """Identifies the model and backend that produced cached vectors, so switching either never reuses them."""
+  return f"{settings.EMBEDDING_MODEL}/{settings.EMBEDDING_CHECKPOINT}/{settings.EMBEDDING_BACKEND}"
+
+def load_query_embedding_cache(path):
+  """Warm the query cache from a file written by `save_query_embedding_cache`; returns entries loaded."""
+  if not path or not os.path.exists(path):
+    return 0
+  data = numpy.load(path, allow_pickle=False)
+  if str(data["model"]) != embedding_model_tag():
+    return 0
+  for key, vector in zip(data["keys"], data["vectors"]):
+    query_embedding_cache.set(str(key), vector)
+  return len(data["keys"])
+
+def save_query_embedding_cache(path):
+  items = query_embedding_cache.items()
+  if not path or not items:
+    return 0
+  keys = [key for key, _ in items]
+  vectors = numpy.stack([numpy.asarray(vector, dtype=numpy.float32) for _, vector in items])
+  tmp_path = f"{path}.tmp.npz"
+  numpy.savez(tmp_path, keys=numpy.array(keys), vectors=vectors, model=numpy.array(embedding_model_tag()))
+  os.replace(tmp_path, path)
+  return len(keys)
+
+
+def product_metadata(product):
+  """Metadata stored next to a product's image embedding; Chroma only accepts scalar values."""
+  return {
+    "_id": str(product["_id"]),
+    "price": float(product["price"]),
+    "category_id": str(product["category_id"]),
+    "merchant_id": str(product["merchant_id"]),
+    "is_active": bool(product.get("is_active", True)),
+  }
+
+def upsert_embeddings(ids,embeddings,metadatas):
+  vector_store.collection.upsert(ids=ids,embeddings=embeddings,metadatas=metadatas)
+
+def search_embedding(embedding,n_results=100,where=None):
+  result = vector_store.collection.query(query_embeddings=[embedding],n_results=n_results,where=where)
+  return result["ids"][0]
 
+def decode_image(data):
+  return numpy.array(Image.open(io.BytesIO(data)))
 
-  collection.add(ids=ids,metadatas=metadatas,images=images)
\ No newline at end of file
+def delete_ids(ids):
+  vector_store.collection.delete(ids=ids)
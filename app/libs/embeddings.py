@@ -0,0 +1,216 @@
+import abc
+import json
+import os
+from typing import Union, cast
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings, Images, is_image
+from PIL import Image
+
+# Embedding backends selectable through settings.EMBEDDING_BACKEND
+TORCH = "torch"
+ONNX = "onnx"
+ONNX_INT8 = "onnx-int8"
+BACKENDS = (TORCH, ONNX, ONNX_INT8)
+
+ONNX_FILES = {
+    ONNX: ("visual.onnx", "textual.onnx"),
+    ONNX_INT8: ("visual.int8.onnx", "textual.int8.onnx"),
+}
+
+
+def resolve_device(device):
+    """Turn "auto" into the best available torch device; any other value is used as given."""
+    if device != "auto":
+        return device
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _normalize(features):
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+class BatchedOpenCLIPEmbeddingFunction(EmbeddingFunction[Union[Documents, Images]]):
+    """
+    Base for OpenCLIP embedding functions that run one forward pass per input kind.
+    Subclasses implement `encode_images` and `encode_texts` over whole batches and
+    return L2-normalized float32 arrays, matching chromadb's OpenCLIPEmbeddingFunction.
+    """
+
+    @abc.abstractmethod
+    def encode_images(self, images):
+        ...
+
+    @abc.abstractmethod
+    def encode_texts(self, texts):
+        ...
+
+    def __call__(self, input: Union[Documents, Images]) -> Embeddings:
+        image_idx = [i for i, item in enumerate(input) if is_image(item)]
+        text_idx = [i for i, item in enumerate(input) if isinstance(item, str)]
+
+        embeddings = [None] * len(input)
+        if image_idx:
+            for i, embedding in zip(image_idx, self.encode_images([input[i] for i in image_idx])):
+                embeddings[i] = embedding
+        if text_idx:
+            for i, embedding in zip(text_idx, self.encode_texts([input[i] for i in text_idx])):
+                embeddings[i] = embedding
+        return cast(Embeddings, [embedding for embedding in embeddings if embedding is not None])
+
+
+class TorchOpenCLIPEmbeddingFunction(BatchedOpenCLIPEmbeddingFunction):
+    def __init__(self, model_name, checkpoint, device="cpu", threads=None):
+        import open_clip
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        self._torch = torch
+        self._device = resolve_device(device)
+        model, _, preprocess = open_clip.create_model_and_transforms(
+            model_name=model_name, pretrained=checkpoint, device=self._device
+        )
+        model.eval()
+        self._model = model
+        self._preprocess = preprocess
+        self._tokenizer = open_clip.get_tokenizer(model_name)
+
+    def encode_images(self, images):
+        pixels = self._torch.stack([self._preprocess(Image.fromarray(image)) for image in images])
+        with self._torch.inference_mode():
+            features = self._model.encode_image(pixels.to(self._device))
+        return _normalize(features.float().cpu().numpy())
+
+    def encode_texts(self, texts):
+        with self._torch.inference_mode():
+            features = self._model.encode_text(self._tokenizer(texts).to(self._device))
+        return _normalize(features.float().cpu().numpy())
+
+
+class OnnxOpenCLIPEmbeddingFunction(BatchedOpenCLIPEmbeddingFunction):
+    """OpenCLIP encoders exported by `export_onnx`, served with ONNX Runtime."""
+
+    def __init__(self, model_dir, quantized=False, device="cpu", threads=None):
+        import onnxruntime
+        import open_clip
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            config = json.load(f)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        if device in ("cuda", "auto") and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        visual_file, textual_file = ONNX_FILES[ONNX_INT8 if quantized else ONNX]
+        self._visual = onnxruntime.InferenceSession(os.path.join(model_dir, visual_file), options, providers=providers)
+        self._textual = onnxruntime.InferenceSession(os.path.join(model_dir, textual_file), options, providers=providers)
+        self._preprocess = open_clip.image_transform(
+            config["image_size"], is_train=False, mean=config["mean"], std=config["std"]
+        )
+        self._tokenizer = open_clip.get_tokenizer(config["model_name"])
+
+    def encode_images(self, images):
+        pixels = np.stack([self._preprocess(Image.fromarray(image)).numpy() for image in images])
+        (features,) = self._visual.run(None, {"pixel_values": pixels.astype(np.float32)})
+        return _normalize(features)
+
+    def encode_texts(self, texts):
+        tokens = self._tokenizer(texts).numpy().astype(np.int64)
+        (features,) = self._textual.run(None, {"input_ids": tokens})
+        return _normalize(features)
+
+
+def create_embedding_function(settings, backend=None):
+    """
+    Build the embedding function selected by settings.EMBEDDING_BACKEND (or `backend`).
+    Args:
+        settings: The application settings.
+        backend (Optional[str]): One of BACKENDS, overriding the configured backend.
+    Returns:
+        BatchedOpenCLIPEmbeddingFunction: The embedding function.
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend == TORCH:
+        return TorchOpenCLIPEmbeddingFunction(
+            settings.EMBEDDING_MODEL,
+            settings.EMBEDDING_CHECKPOINT,
+            device=settings.EMBEDDING_DEVICE,
+            threads=settings.EMBEDDING_THREADS,
+        )
+    if backend in (ONNX, ONNX_INT8):
+        return OnnxOpenCLIPEmbeddingFunction(
+            settings.EMBEDDING_ONNX_DIR,
+            quantized=backend == ONNX_INT8,
+            device=settings.EMBEDDING_DEVICE,
+            threads=settings.EMBEDDING_THREADS,
+        )
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def export_onnx(model_name, checkpoint, out_dir, quantize=True):
+    """
+    Export the OpenCLIP image and text encoders to ONNX, plus an int8 dynamically quantized copy.
+    Args:
+        model_name (str): OpenCLIP architecture, e.g. "ViT-B-32".
+        checkpoint (str): Pretrained weights tag, e.g. "laion2b_s34b_b79k".
+        out_dir (str): Directory that receives the .onnx files and config.json.
+        quantize (bool): Also write the int8 variants.
+    """
+    import open_clip
+    import torch
+
+    model, _, _ = open_clip.create_model_and_transforms(model_name=model_name, pretrained=checkpoint, device="cpu")
+    model.eval()
+    tokenizer = open_clip.get_tokenizer(model_name)
+    image_size = model.visual.image_size
+    image_size = image_size[0] if isinstance(image_size, (tuple, list)) else image_size
+
+    class ImageEncoder(torch.nn.Module):
+        def forward(self, pixel_values):
+            return model.encode_image(pixel_values)
+
+    class TextEncoder(torch.nn.Module):
+        def forward(self, input_ids):
+            return model.encode_text(input_ids)
+
+    os.makedirs(out_dir, exist_ok=True)
+    visual_path, textual_path = (os.path.join(out_dir, name) for name in ONNX_FILES[ONNX])
+    with torch.no_grad():
+        torch.onnx.export(
+            ImageEncoder(), torch.randn(1, 3, image_size, image_size), visual_path,
+            input_names=["pixel_values"], output_names=["embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=17,
+        )
+        torch.onnx.export(
+            TextEncoder(), tokenizer(["a photo of a product"]), textual_path,
+            input_names=["input_ids"], output_names=["embeddings"],
+            dynamic_axes={"input_ids": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=17,
+        )
+
+    with open(os.path.join(out_dir, "config.json"), "w") as f:
+        json.dump({
+            "model_name": model_name,
+            "checkpoint": checkpoint,
+            "image_size": image_size,
+            "mean": list(getattr(model.visual, "image_mean", None) or open_clip.OPENAI_DATASET_MEAN),
+            "std": list(getattr(model.visual, "image_std", None) or open_clip.OPENAI_DATASET_STD),
+        }, f)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for source, target in zip(ONNX_FILES[ONNX], ONNX_FILES[ONNX_INT8]):
+            quantize_dynamic(os.path.join(out_dir, source), os.path.join(out_dir, target), weight_type=QuantType.QInt8)
@@ -0,0 +1,112 @@
+import hashlib
+from bson import json_util
+from fastapi import HTTPException, status
+from app.core.config import settings
+from app.libs.cache import TTLCache
+from app.libs.category_utils import category_index
+
+FACETS = ("category", "merchant", "price")
+# Lower bounds of the price histogram buckets; prices from the last bound upwards share one bucket
+PRICE_BOUNDARIES = [0, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+FACET_LIMIT = 20
+
+facet_cache = TTLCache(
+    max_size=settings.FACET_CACHE_SIZE,
+    ttl_seconds=settings.FACET_CACHE_TTL_SECONDS,
+    name="facet_cache",
+)
+
+
+def parse_facets(value):
+    """Turn the comma separated `facets` query parameter into a list of facet names."""
+    if not value:
+        return []
+    names = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown facets: {', '.join(unknown)}. Expected {', '.join(FACETS)}"
+        )
+    return names
+
+
+def facet_pipelines(names):
+    """`$facet` sub-pipelines for the requested facets, applied to the already filtered products."""
+    pipelines = {
+        "category": [
+            {"$group": {"_id": "$category_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT},
+        ],
+        "merchant": [
+            {"$group": {"_id": "$merchant_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT},
+            {"$lookup": {"from": "merchants", "localField": "_id", "foreignField": "_id", "as": "merchant"}},
+            {"$project": {"count": 1, "name": {"$arrayElemAt": ["$merchant.business_name", 0]}}},
+        ],
+        "price": [
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BOUNDARIES + [float("inf")],
+                "default": "other",
+                "output": {"count": {"$sum": 1}},
+            }},
+        ],
+    }
+    return {name: pipelines[name] for name in names}
+
+
+def format_facets(raw, names):
+    facets = {}
+    if "category" in names:
+        facets["category"] = [
+            {
+                "category_id": str(row["_id"]) if row["_id"] else None,
+                "name": category_index.categories.get(row["_id"], {}).get("name"),
+                "count": row["count"],
+            }
+            for row in raw["category"]
+        ]
+    if "merchant" in names:
+        facets["merchant"] = [
+            {"merchant_id": str(row["_id"]) if row["_id"] else None, "name": row.get("name"), "count": row["count"]}
+            for row in raw["merchant"]
+        ]
+    if "price" in names:
+        upper = dict(zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:]))
+        facets["price"] = [
+            {"min": row["_id"], "max": upper.get(row["_id"]), "count": row["count"]}
+            for row in raw["price"] if row["_id"] != "other"
+        ]
+    return facets
+
+
+def facet_signature(query, names):
+    """Cache key for the facets of a filter document; key order in the filter does not matter."""
+    payload = json_util.dumps([query, sorted(names)], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+async def count_facets(db, query, names):
+    """
+    Facet counts of a product listing filter, from one $facet aggregation.
+    The page itself is fetched separately with an indexed find; sorting it inside
+    $facet would sort the whole filtered set in memory. Facets depend only on the
+    filter, so cached facets for the same filter are reused.
+    Args:
+        db: The database instance.
+        query (dict): The listing filter.
+        names (List[str]): Requested facets, see FACETS.
+    Returns:
+        dict: The facets keyed by name.
+    """
+    await category_index.ensure_loaded(db)
+    signature = facet_signature(query, names)
+    facets = facet_cache.get(signature)
+    if facets is None:
+        result = (await db.products.aggregate([{"$match": query}, {"$facet": facet_pipelines(names)}]).to_list(1))[0]
+        facets = format_facets(result, names)
+        facet_cache.set(signature, facets)
+    return facets
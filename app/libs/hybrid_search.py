@@ -0,0 +1,65 @@
+import asyncio
+from pymongo.errors import OperationFailure
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.chromadb import embed_query, vector_store
+from app.libs.stock import HIDDEN_PRODUCT_FIELDS
+from app.libs.vector_search import filtered_vector_search
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """
+    Merge ranked id lists with reciprocal-rank fusion: each list adds 1 / (k + rank)
+    to the score of every id it contains, so items ranked well by several retrievers
+    rise to the top without having to calibrate their raw scores against each other.
+    Args:
+        rankings (Iterable[List]): Ranked id lists, best first.
+        k (Optional[int]): Rank offset, defaults to HYBRID_SEARCH_RRF_K.
+    Returns:
+        List: Ids ordered by fused score, best first.
+    """
+    k = k or settings.HYBRID_SEARCH_RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, _id in enumerate(ranking, start=1):
+            scores[_id] = scores.get(_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda _id: scores[_id], reverse=True)
+
+
+async def keyword_search(db, text, query, n_results):
+    """Products matching the query filter, ranked by the products text index score."""
+    try:
+        docs = await db.products.find(
+            {"$and": [query, {"$text": {"$search": text}}]},
+            {"_id": 1, "score": {"$meta": "textScore"}},
+        ).sort([("score", {"$meta": "textScore"})]).limit(n_results).to_list(n_results)
+    except OperationFailure as e:
+        # Missing text index: degrade to vector-only ranking instead of failing the search
+        logger.warning(f"Keyword search unavailable: {e}")
+        return []
+    return [doc["_id"] for doc in docs]
+
+
+async def vector_search(db, text, query, where, n_results):
+    await vector_store.ensure_started()
+    embedding = await embed_query(text)
+    return await filtered_vector_search(db, embedding, query, where, n_results)
+
+
+async def hydrate_page(db, ids):
+    """Load products for the given ids with one query, preserving the order of `ids`."""
+    products = {product["_id"]: product async for product in db.products.find({"_id": {"$in": ids}}, HIDDEN_PRODUCT_FIELDS)}
+    return [products[_id] for _id in ids if _id in products]
+
+
+async def hybrid_rank(db, text, query, where, n_results):
+    """Fused ranking of the top `n_results` candidates from each retriever."""
+    keyword_ids, vector_ids = await asyncio.gather(
+        keyword_search(db, text, query, n_results),
+        vector_search(db, text, query, where, n_results),
+    )
+    return reciprocal_rank_fusion([keyword_ids, vector_ids])
+
+
+def search_candidates(skip, limit):
+    return min(max(skip + limit, settings.HYBRID_SEARCH_CANDIDATES), settings.VECTOR_SEARCH_MAX_RESULTS)
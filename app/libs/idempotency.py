@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+from bson import json_util
+from fastapi import HTTPException, status
+from pymongo.errors import DuplicateKeyError
+from app.core.config import settings
+from app.libs.metrics import counter
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Key states; a key whose request was rejected with a client error is deleted so the client can retry it
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+POLL_SECONDS = 0.05
+
+replays = counter("idempotent_replays")
+
+
+def request_fingerprint(payload):
+    """Hash of the request parameters; a key may only be reused with the same ones."""
+    return hashlib.sha256(json_util.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def _claim(db, key_id, fingerprint, lock):
+    """
+    Take the key for this request.
+    Returns:
+        Optional[dict]: None if the key was claimed, otherwise the record holding it.
+    """
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": key_id,
+            "fingerprint": fingerprint,
+            "status": IN_PROGRESS,
+            "lock": lock,
+            "locked_until": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS),
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # A worker that died mid-request leaves its lock behind; take it over once the lease ran out
+    taken = await db.idempotency_keys.update_one(
+        {"_id": key_id, "fingerprint": fingerprint, "status": IN_PROGRESS, "locked_until": {"$lt": now}},
+        {"$set": {"lock": lock, "locked_until": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)}},
+    )
+    if taken.modified_count:
+        return None
+    return await db.idempotency_keys.find_one({"_id": key_id}) or {}
+
+
+async def run_idempotent(db, scope, key, payload, handler, response=None):
+    """
+    Run `handler` at most once per idempotency key and replay its result for retries.
+    The first request with a key inserts an in-progress record; duplicates arriving
+    meanwhile poll it until the stored result appears instead of running the handler
+    again. Only successful results are stored. A client error (4xx HTTPException) is
+    raised before anything is written, so its key is dropped and the retry runs again;
+    after any other failure or a cancellation the outcome is unknown, so the key stays
+    locked until IDEMPOTENCY_LOCK_SECONDS pass. Records expire after
+    IDEMPOTENCY_KEY_TTL_SECONDS.
+    Args:
+        db: The database instance.
+        scope (str): Route and caller the key belongs to, so keys of different users never collide.
+        key (Optional[str]): The Idempotency-Key header; without one the handler just runs.
+        payload: Request parameters, fingerprinted to reject a key reused for a different request.
+        handler: Coroutine function producing the response body.
+        response (Optional[Response]): Gets an Idempotent-Replayed header on replays.
+    Returns:
+        The handler's result, or the stored result of the first request with this key.
+    """
+    if key is None:
+        return await handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters"
+        )
+
+    key_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    lock = uuid4().hex
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while (record := await _claim(db, key_id, fingerprint, lock)) is not None:
+        if record.get("fingerprint", fingerprint) != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+            )
+        if record.get("status") == COMPLETED:
+            replays.inc()
+            if response is not None:
+                response.headers[REPLAYED_HEADER] = "true"
+            return record["response"]
+        if time.monotonic() > deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"A request with this {IDEMPOTENCY_HEADER} is still in progress"
+            )
+        await asyncio.sleep(POLL_SECONDS)
+
+    try:
+        result = await handler()
+    except HTTPException as e:
+        if e.status_code < 500:
+            await db.idempotency_keys.delete_one({"_id": key_id, "lock": lock})
+        raise
+    await db.idempotency_keys.update_one(
+        {"_id": key_id, "lock": lock},
+        {"$set": {"status": COMPLETED, "response": result, "completed_at": datetime.utcnow()},
+         "$unset": {"lock": "", "locked_until": ""}},
+    )
+    return result
@@ -0,0 +1,147 @@
+import hashlib
+from datetime import datetime, timedelta
+import httpx
+import numpy as np
+from bson import Binary
+from pymongo import UpdateOne
+from app.core.config import settings
+from app.libs.chromadb import decode_image, embedding_batcher, embedding_model_tag, vector_store
+from app.libs.inference import inference
+from app.libs.metrics import counter
+
+# Image embeddings are cached in Mongo by sha256 of the image bytes (image_embeddings),
+# and image URLs remember the validators and hash of their last download (image_sources)
+# so an unchanged image can be confirmed with a conditional GET and no body.
+# Entries only used by search-by-image queries carry expires_at and are purged by a TTL index.
+cache_hits = counter("image_embedding_cache_hits")
+cache_misses = counter("image_embedding_cache_misses")
+not_modified = counter("image_source_not_modified")
+
+_http_client = None
+
+
+def http_client():
+    """Shared client for image downloads outside the bulk reindexer; closed by `close_http_client`."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=settings.REINDEX_DOWNLOAD_TIMEOUT_SECONDS, follow_redirects=True)
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cache_key(image_hash):
+    return f"{embedding_model_tag()}:{image_hash}"
+
+
+async def cached_embeddings(db, hashes):
+    """
+    Look up cached embeddings for the current model.
+    Args:
+        db: The database instance.
+        hashes (Iterable[str]): Image content hashes.
+    Returns:
+        Dict[str, numpy.ndarray]: Hash -> embedding, for the hashes that are cached.
+    """
+    keys = {_cache_key(image_hash): image_hash for image_hash in set(hashes)}
+    if not keys:
+        return {}
+    found = {}
+    async for doc in db.image_embeddings.find({"_id": {"$in": list(keys)}}):
+        found[keys[doc["_id"]]] = np.frombuffer(doc["vector"], dtype=np.float32)
+    cache_hits.inc(len(found))
+    cache_misses.inc(len(keys) - len(found))
+    return found
+
+
+async def store_embeddings(db, hashes, embeddings, ttl_seconds=None):
+    """
+    Cache embeddings by content hash with one bulk write.
+    Args:
+        ttl_seconds (Optional[int]): Expire new entries after this long (query images). Without
+            it the entries are kept, and an expiring entry for the same image is made permanent.
+    """
+    now = datetime.utcnow()
+    ops = []
+    for image_hash, embedding in zip(hashes, embeddings):
+        update = {"$setOnInsert": {
+            "model": embedding_model_tag(),
+            "vector": Binary(np.asarray(embedding, dtype=np.float32).tobytes()),
+            "created_at": now,
+        }}
+        if ttl_seconds:
+            update["$setOnInsert"]["expires_at"] = now + timedelta(seconds=ttl_seconds)
+        else:
+            update["$unset"] = {"expires_at": ""}
+        ops.append(UpdateOne({"_id": _cache_key(image_hash)}, update, upsert=True))
+    if ops:
+        await db.image_embeddings.bulk_write(ops, ordered=False)
+
+
+async def embed_image_bytes(db, data, image_hash=None, ttl_seconds=None):
+    """Embed one image through the request batcher unless identical bytes were embedded before."""
+    image_hash = image_hash or content_hash(data)
+    embedding = (await cached_embeddings(db, [image_hash])).get(image_hash)
+    if embedding is None:
+        image = await inference.run(decode_image, data)
+        await vector_store.ensure_started()
+        embedding = await embedding_batcher.embed(image)
+        await store_embeddings(db, [image_hash], [embedding], ttl_seconds)
+    return embedding
+
+
+async def fetch_image(db, client, url):
+    """
+    Download an image, revalidating against the previous download of the same URL.
+    Returns:
+        Tuple[str, Optional[bytes]]: The content hash and the image bytes. The bytes are None
+        when the server answered 304 and the embedding for that hash is already cached.
+    """
+    source = await db.image_sources.find_one({"_id": url})
+    headers = {}
+    if source and source.get("etag"):
+        headers["If-None-Match"] = source["etag"]
+    if source and source.get("last_modified"):
+        headers["If-Modified-Since"] = source["last_modified"]
+
+    if headers:
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304 and source["hash"] in await cached_embeddings(db, [source["hash"]]):
+            not_modified.inc()
+            return source["hash"], None
+        if response.status_code == 304:
+            # The cached vector is gone, so the body is needed after all
+            response = await client.get(url)
+    else:
+        response = await client.get(url)
+    response.raise_for_status()
+
+    data = response.content
+    image_hash = content_hash(data)
+    await db.image_sources.update_one(
+        {"_id": url},
+        {"$set": {
+            "hash": image_hash,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "checked_at": datetime.utcnow(),
+        }},
+        upsert=True,
+    )
+    return image_hash, data
+
+
+async def embed_image_url(db, url):
+    image_hash, data = await fetch_image(db, http_client(), url)
+    if data is None:
+        return (await cached_embeddings(db, [image_hash]))[image_hash]
+    return await embed_image_bytes(db, data, image_hash)
@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.chromadb import delete_ids, product_metadata, upsert_embeddings, vector_store
+from app.libs.image_embeddings import embed_image_url
+from app.libs.inference import inference
+from app.libs.related_products import refresh_related_products
+
+# Job operations
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Job states; "dead" jobs exhausted their retries and wait for manual requeue
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# Set whenever a job is enqueued so this process's workers pick it up without waiting for the next poll
+_wakeup = asyncio.Event()
+
+
+async def enqueue_index_job(db, product_id, op=UPSERT):
+    """
+    Ask the indexing workers to bring a product's vector entry up to date.
+    There is one job document per product, so repeated writes coalesce into a single
+    job and the latest operation wins. `seq` lets a worker that finishes an older
+    version of the job avoid marking a newer request done.
+    """
+    now = datetime.utcnow()
+    await db.index_jobs.update_one(
+        {"_id": str(product_id)},
+        {
+            "$set": {
+                "op": op,
+                "status": PENDING,
+                "attempts": 0,
+                "next_run_at": now,
+                "last_error": None,
+                "updated_at": now,
+            },
+            "$inc": {"seq": 1},
+            # done_at is only set on done jobs; the TTL index must not purge a job that is pending again
+            "$unset": {"done_at": ""},
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True,
+    )
+    _wakeup.set()
+
+
+async def claim_index_job(db):
+    """Lease the next due job, including jobs whose worker died mid-run."""
+    now = datetime.utcnow()
+    return await db.index_jobs.find_one_and_update(
+        {"$or": [
+            {"status": PENDING, "next_run_at": {"$lte": now}},
+            {"status": RUNNING, "locked_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {"status": RUNNING, "locked_until": now + timedelta(seconds=settings.INDEXING_LEASE_SECONDS)},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("next_run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def index_product(product_id, db):
+    """Idempotently upsert one product's image embedding, or remove it if the product is gone or inactive."""
+    await vector_store.ensure_started()
+    product = await db.products.find_one({"_id": ObjectId(product_id)})
+    if not product or not product.get("is_active", True) or not product.get("images"):
+        await inference.run(delete_ids, [product_id])
+        return
+
+    embedding = await embed_image_url(db, product["images"][0])
+    await inference.run(upsert_embeddings, [product_id], [embedding], [product_metadata(product)])
+    await refresh_related_products(product_id, db)
+
+
+async def run_index_job(db, job):
+    try:
+        if job["op"] == DELETE:
+            await vector_store.ensure_started()
+            await inference.run(delete_ids, [job["_id"]])
+        else:
+            await index_product(job["_id"], db)
+    except Exception as e:
+        now = datetime.utcnow()
+        if job["attempts"] >= settings.INDEXING_MAX_ATTEMPTS:
+            update = {"status": DEAD, "locked_until": None, "last_error": str(e), "updated_at": now}
+            logger.error(f"Index job for product {job['_id']} dead-lettered: {e}")
+        else:
+            backoff = min(settings.INDEXING_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1), 3600)
+            update = {
+                "status": PENDING,
+                "locked_until": None,
+                "last_error": str(e),
+                "next_run_at": now + timedelta(seconds=backoff),
+                "updated_at": now,
+            }
+        await db.index_jobs.update_one({"_id": job["_id"], "seq": job["seq"]}, {"$set": update})
+        return False
+
+    now = datetime.utcnow()
+    await db.index_jobs.update_one(
+        {"_id": job["_id"], "seq": job["seq"]},
+        {"$set": {"status": DONE, "locked_until": None, "last_error": None, "done_at": now, "updated_at": now}}
+    )
+    return True
+
+
+async def indexing_worker(db):
+    """Background loop started from the app lifespan; several run concurrently."""
+    while True:
+        try:
+            job = await claim_index_job(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not claim index job: {e}")
+            job = None
+
+        if job is not None:
+            await run_index_job(db, job)
+            continue
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.INDEXING_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def requeue_dead_index_jobs(db):
+    """Move dead-lettered jobs back to pending with a fresh retry budget."""
+    now = datetime.utcnow()
+    result = await db.index_jobs.update_many(
+        {"status": DEAD},
+        {"$set": {"status": PENDING, "attempts": 0, "next_run_at": now, "updated_at": now}}
+    )
+    return result.modified_count
+
+
+async def index_job_counts(db):
+    rows = await db.index_jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]).to_list(None)
+    return {row["_id"]: row["count"] for row in rows}
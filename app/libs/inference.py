@@ -0,0 +1,66 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for CLIP inference and Chroma queries.
+    torch and ONNX Runtime release the GIL while they compute, so threads give real
+    parallelism without copying the model into worker processes. At most
+    `max_workers + max_queue` calls are admitted at once; further calls fail fast
+    with 503 instead of piling up behind a slow model.
+    """
+
+    def __init__(self, max_workers, max_queue, timeout):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+
+    def _release(self, _future):
+        self.in_flight -= 1
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run a blocking callable on the pool and await its result.
+        Args:
+            fn (Callable): The blocking function.
+            timeout (Optional[float]): Seconds to wait, defaults to the executor timeout.
+        Returns:
+            The function's return value.
+        Raises:
+            HTTPException: 503 when the pool is saturated or the call times out.
+        """
+        if self.in_flight >= self.capacity:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        future = loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        # The slot is held until the thread finishes, even if the caller stops waiting
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search timed out, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+inference = InferenceExecutor(
+    max_workers=settings.INFERENCE_WORKERS,
+    max_queue=settings.INFERENCE_QUEUE_SIZE,
+    timeout=settings.INFERENCE_TIMEOUT_SECONDS,
+)
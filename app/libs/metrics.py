@@ -0,0 +1,69 @@
+import bisect
+import threading
+
+# Bucket upper bounds shared by the latency histograms, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    """Fixed-bucket histogram; each bucket counts observations <= its upper bound."""
+
+    def __init__(self, name, buckets):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+            buckets["+Inf"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 3),
+                "mean": round(self.sum / self.count, 3) if self.count else None,
+                "buckets": buckets,
+            }
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name, buckets=LATENCY_BUCKETS_MS):
+    with _registry_lock:
+        return _registry.setdefault(name, Histogram(name, buckets))
+
+
+def counter(name):
+    with _registry_lock:
+        return _registry.setdefault(name, Counter(name))
+
+
+def snapshot():
+    """Current value of every registered metric, keyed by name."""
+    with _registry_lock:
+        metrics = dict(_registry)
+    return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
@@ -0,0 +1,69 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+# Orders carry the names they were placed under, so reads need no $lookup:
+# order.merchant_name, order.user_name and items[].product_name. Names are not
+# updated when a product, merchant or user is renamed later.
+MISSING_SNAPSHOT = {"$or": [
+    {"merchant_name": {"$exists": False}},
+    {"user_name": {"$exists": False}},
+    {"items": {"$elemMatch": {"product_name": {"$exists": False}}}},
+]}
+
+
+def _object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+async def _names(collection, ids, field):
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return {}
+    return {doc["_id"]: doc.get(field) or "" async for doc in collection.find({"_id": {"$in": ids}}, {field: 1})}
+
+
+async def backfill_order_names(db, batch_size=500):
+    """
+    Write the name snapshots into orders placed before create_order recorded them.
+    Names are looked up with one query per collection per batch; orders whose product,
+    merchant or user no longer exists get "" like the old read-time $lookup did.
+    Args:
+        db: The database instance.
+        batch_size (int): Orders updated per bulk write.
+    Returns:
+        int: Number of orders updated.
+    """
+    updated = 0
+    while True:
+        # Updated orders stop matching, so every round reads the next batch from the start
+        orders = await db.orders.find(
+            MISSING_SNAPSHOT, {"merchant_id": 1, "merchant_name": 1, "user_id": 1, "user_name": 1, "items": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not orders:
+            return updated
+
+        merchants = await _names(db.merchants, {order.get("merchant_id") for order in orders}, "business_name")
+        users = await _names(db.users, {order.get("user_id") for order in orders}, "full_name")
+        products = await _names(
+            db.products,
+            {_object_id(item.get("product_id")) for order in orders for item in order.get("items", [])},
+            "name",
+        )
+
+        ops = []
+        for order in orders:
+            items = [
+                {**item, "product_name": item.get("product_name", products.get(_object_id(item.get("product_id")), ""))}
+                for item in order.get("items", [])
+            ]
+            ops.append(UpdateOne({"_id": order["_id"]}, {"$set": {
+                "merchant_name": order.get("merchant_name", merchants.get(order.get("merchant_id"), "")),
+                "user_name": order.get("user_name", users.get(order.get("user_id"), "")),
+                "items": items,
+            }}))
+        await db.orders.bulk_write(ops, ordered=False)
+        updated += len(ops)
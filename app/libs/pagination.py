@@ -0,0 +1,59 @@
+import base64
+from bson import json_util
+from fastapi import HTTPException, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(doc, sort):
+    """
+    Build an opaque cursor from the sort key values of the last document on a page.
+    Args:
+        doc (dict): The last document returned, before any ObjectId-to-str conversion.
+        sort (List[Tuple[str, int]]): The sort specification the page was fetched with.
+    Returns:
+        str: URL-safe cursor token.
+    """
+    values = [doc.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, sort):
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return values
+
+def apply_cursor(query, sort, cursor):
+    """
+    Restrict a query to the documents strictly after the cursor in the given sort order.
+    Args:
+        query (dict): The filter document for the listing.
+        sort (List[Tuple[str, int]]): Sort specification, ending with a unique field such as `_id`.
+        cursor (Optional[str]): Token produced by `encode_cursor`, or None for the first page.
+    Returns:
+        dict: The filter document for the requested page.
+    """
+    if not cursor:
+        return query
+    values = decode_cursor(cursor, sort)
+
+    # (a > x) OR (a == x AND b > y) OR ... for each prefix of the sort key
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        clauses.append(clause)
+    keyset = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+    return {"$and": [query, keyset]} if query else keyset
+
+def next_cursor(docs, sort, limit):
+    """Return the cursor for the page after `docs`, or None when this was the last page."""
+    if len(docs) < limit:
+        return None
+    return encode_cursor(docs[-1], sort)
@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime
+import httpx
+from bson import ObjectId
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.chromadb import decode_image, delete_ids, embed, product_metadata, upsert_embeddings, vector_store
+from app.libs.image_embeddings import cached_embeddings, fetch_image, store_embeddings
+from app.libs.indexing import enqueue_index_job
+from app.libs.inference import inference
+
+FULL = "full"
+INCREMENTAL = "incremental"
+
+CHECKPOINT_ID = "catalog"
+PRODUCT_PROJECTION = {"_id": 1, "images": 1, "price": 1, "category_id": 1, "merchant_id": 1, "is_active": 1}
+
+
+def decode_images(blobs):
+    """Decode downloaded images, with None for the ones that are not valid images."""
+    images = []
+    for blob in blobs:
+        try:
+            images.append(decode_image(blob))
+        except Exception:
+            images.append(None)
+    return images
+
+
+async def download(db, client, semaphore, url):
+    async with semaphore:
+        return await fetch_image(db, client, url)
+
+
+async def reindex_batch(db, client, semaphore, products):
+    """
+    Download, embed and upsert one batch of products.
+    Returns:
+        Tuple[int, int]: (products upserted or removed, products that failed and were handed to the index queue).
+    """
+    removed = [str(p["_id"]) for p in products if not p.get("is_active", True) or not p.get("images")]
+    indexable = [p for p in products if p.get("is_active", True) and p.get("images")]
+    if removed:
+        await inference.run(delete_ids, removed)
+
+    results = await asyncio.gather(
+        *(download(db, client, semaphore, p["images"][0]) for p in indexable), return_exceptions=True
+    )
+    downloaded = [(p, result) for p, result in zip(indexable, results) if not isinstance(result, BaseException)]
+    failed = [p for p, result in zip(indexable, results) if isinstance(result, BaseException)]
+
+    # Identical images, within the batch or seen before, are embedded once
+    embeddings = await cached_embeddings(db, [image_hash for _, (image_hash, _) in downloaded])
+    misses = {image_hash: data for _, (image_hash, data) in downloaded if image_hash not in embeddings and data}
+    if misses:
+        images = await inference.run(decode_images, list(misses.values()))
+        decoded = {image_hash: image for image_hash, image in zip(misses, images) if image is not None}
+        if decoded:
+            vectors = await inference.run(embed, list(decoded.values()), timeout=settings.REINDEX_BATCH_TIMEOUT_SECONDS)
+            await store_embeddings(db, list(decoded), vectors)
+            embeddings.update(zip(decoded, vectors))
+
+    embedded = [(p, embeddings[image_hash]) for p, (image_hash, _) in downloaded if image_hash in embeddings]
+    failed += [p for p, (image_hash, _) in downloaded if image_hash not in embeddings]
+    if embedded:
+        await inference.run(
+            upsert_embeddings,
+            [str(p["_id"]) for p, _ in embedded],
+            [embedding for _, embedding in embedded],
+            [product_metadata(p) for p, _ in embedded],
+        )
+
+    # Failed downloads and undecodable images go through the retrying index queue instead of failing the run
+    for product in failed:
+        await enqueue_index_job(db, product["_id"])
+    return len(embedded) + len(removed), len(failed)
+
+
+async def reindex_catalog(db, mode=FULL, restart=False, batch_size=None, concurrency=None):
+    """
+    Stream products from Mongo and rebuild their vector entries batch by batch.
+    Progress is checkpointed in the reindex_state collection after every batch; an
+    interrupted run of the same mode resumes after the last checkpointed product
+    unless `restart` is set. Incremental runs only visit products changed since the
+    previous completed run started.
+    Returns:
+        dict: The final checkpoint document.
+    """
+    batch_size = batch_size or settings.REINDEX_BATCH_SIZE
+    concurrency = concurrency or settings.REINDEX_DOWNLOAD_CONCURRENCY
+    state = await db.reindex_state.find_one({"_id": CHECKPOINT_ID}) or {}
+
+    if not restart and state.get("status") == "running" and state.get("mode") == mode:
+        started_at, since = state["started_at"], state.get("since")
+        query_after = state.get("last_id")
+        logger.info(f"Resuming {mode} reindex after {query_after}")
+    else:
+        started_at = datetime.utcnow()
+        since = state.get("last_completed_started_at") if mode == INCREMENTAL else None
+        query_after = None
+        await db.reindex_state.update_one(
+            {"_id": CHECKPOINT_ID},
+            {"$set": {
+                "status": "running", "mode": mode, "started_at": started_at, "since": since,
+                "last_id": None, "processed": 0, "failed": 0,
+            }},
+            upsert=True,
+        )
+
+    clauses = []
+    if since:
+        # Products created before updated_at was recorded fall back to their ObjectId timestamp
+        clauses.append({"$or": [
+            {"updated_at": {"$gt": since}},
+            {"updated_at": {"$exists": False}, "_id": {"$gt": ObjectId.from_datetime(since)}},
+        ]})
+    if query_after:
+        clauses.append({"_id": {"$gt": query_after}})
+    query = {"$and": clauses} if clauses else {}
+
+    await vector_store.ensure_started()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=settings.REINDEX_DOWNLOAD_TIMEOUT_SECONDS, follow_redirects=True) as client:
+        cursor = db.products.find(query, PRODUCT_PROJECTION).sort("_id", 1).batch_size(batch_size)
+        batch = []
+        async for product in cursor:
+            batch.append(product)
+            if len(batch) < batch_size:
+                continue
+            await _checkpoint(db, batch, await reindex_batch(db, client, semaphore, batch))
+            batch = []
+        if batch:
+            await _checkpoint(db, batch, await reindex_batch(db, client, semaphore, batch))
+
+    await db.reindex_state.update_one(
+        {"_id": CHECKPOINT_ID},
+        {"$set": {"status": "completed", "completed_at": datetime.utcnow(), "last_completed_started_at": started_at}}
+    )
+    return await db.reindex_state.find_one({"_id": CHECKPOINT_ID})
+
+
+async def _checkpoint(db, batch, counts):
+    processed, failed = counts
+    await db.reindex_state.update_one(
+        {"_id": CHECKPOINT_ID},
+        {"$set": {"last_id": batch[-1]["_id"], "updated_at": datetime.utcnow()},
+         "$inc": {"processed": processed, "failed": failed}}
+    )
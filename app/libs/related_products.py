@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.chromadb import vector_store
+from app.libs.inference import inference
+from app.libs.stock import HIDDEN_PRODUCT_FIELDS
+from app.libs.stock_shards import attach_stock
+
+
+def nearest_product_ids(product_id, n_results):
+    """
+    Find the products whose stored image embeddings are closest to this product's.
+    Args:
+        product_id (str): The product ID, as stored in the vector collection.
+        n_results (int): How many neighbours to return, excluding the product itself.
+    Returns:
+        Optional[List[str]]: Neighbour IDs, closest first, or None if the product is not indexed.
+    """
+    stored = vector_store.collection.get(ids=[product_id], include=["embeddings"])
+    embeddings = stored.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    result = vector_store.collection.query(query_embeddings=[embeddings[0]], n_results=n_results + 1)
+    return [_id for _id in result["ids"][0] if _id != product_id][:n_results]
+
+
+async def refresh_related_products(product_id, db):
+    """
+    Recompute and store one product's related product IDs.
+    A product that is not in the vector collection yet keeps its list and stays stale;
+    the indexing worker refreshes it once it is indexed, and the background refresher
+    checks it again after RELATED_PRODUCTS_RETRY_SECONDS.
+    Returns:
+        bool: Whether the product was indexed.
+    """
+    await vector_store.ensure_started()
+    related_ids = await inference.run(nearest_product_ids, str(product_id), settings.RELATED_PRODUCTS_COUNT)
+    now = datetime.utcnow()
+    update = {"related_checked_at": now}
+    if related_ids is not None:
+        update.update({"related_product_ids": related_ids, "related_refreshed_at": now})
+    await db.products.update_one({"_id": ObjectId(product_id)}, {"$set": update})
+    return related_ids is not None
+
+
+async def claim_related_refresh(product, db):
+    """
+    Decide whether a product read should schedule `refresh_related_products`.
+    Only products without a related list qualify, and only once per
+    RELATED_PRODUCTS_RETRY_SECONDS: the check time is claimed with a conditional
+    write, so concurrent reads of an unindexed product schedule at most one refresh.
+    Returns:
+        bool: Whether the caller should schedule the refresh.
+    """
+    if "related_refreshed_at" in product:
+        return False
+    now = datetime.utcnow()
+    retry_before = now - timedelta(seconds=settings.RELATED_PRODUCTS_RETRY_SECONDS)
+    checked_at = product.get("related_checked_at")
+    if checked_at and checked_at >= retry_before:
+        return False
+    result = await db.products.update_one(
+        {
+            "_id": product["_id"],
+            "related_refreshed_at": {"$exists": False},
+            "related_checked_at": {"$not": {"$gte": retry_before}},
+        },
+        {"$set": {"related_checked_at": now}}
+    )
+    return result.modified_count > 0
+
+
+async def refresh_stale_related_products(db, max_age_seconds=None, batch_size=None):
+    """
+    Refresh the related lists that are missing or older than `max_age_seconds`.
+    Returns:
+        int: Number of products refreshed.
+    """
+    max_age_seconds = settings.RELATED_PRODUCTS_MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=max_age_seconds)
+    query = {
+        "is_active": True,
+        "$or": [
+            {"related_refreshed_at": {"$exists": False}},
+            {"related_refreshed_at": {"$lt": stale_before}},
+        ],
+        # Products missing from the vector index are not rechecked on every run
+        "related_checked_at": {"$not": {"$gte": now - timedelta(seconds=settings.RELATED_PRODUCTS_RETRY_SECONDS)}},
+    }
+    cursor = db.products.find(query, {"_id": 1})
+    if batch_size:
+        cursor = cursor.limit(batch_size)
+
+    refreshed = 0
+    async for product in cursor:
+        if await refresh_related_products(product["_id"], db):
+            refreshed += 1
+    return refreshed
+
+
+async def related_products_refresher(db, interval_seconds):
+    """Background loop started from the app lifespan."""
+    while True:
+        try:
+            await refresh_stale_related_products(db, batch_size=settings.RELATED_PRODUCTS_REFRESH_BATCH)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Related products refresh failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+async def hydrate_related_products(product, db):
+    """
+    Load the stored related products for a product document with one `$in` query.
+    Returns:
+        List[dict]: Active related products in stored order, with string IDs.
+    """
+    related_ids = product.get("related_product_ids") or []
+    if not related_ids:
+        return []
+    related = await db.products.find(
+        {"_id": {"$in": [ObjectId(_id) for _id in related_ids]}, "is_active": True},
+        {"related_product_ids": 0, **HIDDEN_PRODUCT_FIELDS}
+    ).to_list(len(related_ids))
+    await attach_stock(db, related)
+    related_map = {str(sku["_id"]): sku for sku in related}
+    related_products = [related_map[_id] for _id in related_ids if _id in related_map]
+    for sku in related_products:
+        sku["_id"] = str(sku["_id"])
+        sku["merchant_id"] = str(sku["merchant_id"])
+        sku["category_id"] = str(sku["category_id"])
+    return related_products
@@ -0,0 +1,325 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.stock import StockConflict, available_at_least, run_in_transaction
+from app.libs.stock_shards import hold_sharded, return_stock, settle_sharded
+
+# Reservation states; only "active" holds count towards products.reserved_quantity
+ACTIVE = "active"
+CONVERTED = "converted"
+RELEASED = "released"
+EXPIRED = "expired"
+# A converted reservation whose units went back on hand because the paid order was cancelled
+RESTOCKED = "restocked"
+
+# Finished reservations are purged by the TTL index this long after they were closed
+RETENTION = timedelta(days=7)
+
+# Hold tags older than this belong to checkouts that died between their hold and its cleanup
+STALE_HOLD_TAG_AGE = timedelta(minutes=5)
+
+
+def _hold_ops(quantities, tag=None):
+    ops = []
+    for product_id, quantity in quantities.items():
+        update = {"$inc": {"reserved_quantity": quantity}}
+        if tag is not None:
+            update["$push"] = {"stock_holds": tag}
+        ops.append(UpdateOne(
+            # Products switched to sharded stock meanwhile do not match; the checkout is retried
+            {"_id": product_id, "is_active": True, "stock_shards": {"$exists": False}, **available_at_least(quantity)},
+            update,
+        ))
+    return ops
+
+
+def _settle_ops(items, convert):
+    """Counter updates that close a hold: release it, or also take the units off on-hand stock."""
+    ops = []
+    for item in items:
+        if "shards" in item:
+            continue
+        update = {"reserved_quantity": -item["quantity"]}
+        if convert:
+            update["stock_quantity"] = -item["quantity"]
+        ops.append(UpdateOne({"_id": item["product_id"]}, {"$inc": update}))
+    return ops
+
+
+async def _undo_tagged_holds(db, quantities, tag):
+    if not quantities:
+        return
+    await db.products.bulk_write([
+        UpdateOne(
+            {"_id": product_id, "stock_holds": tag},
+            {"$inc": {"reserved_quantity": -quantity}, "$pull": {"stock_holds": tag}},
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+
+
+async def _hold_sharded_items(db, items, sharded, session=None):
+    """Hold the sharded products' items, recording their shard allocations on the items."""
+    held = []
+    try:
+        for item in items:
+            if item["product_id"] in sharded:
+                item["shards"] = await hold_sharded(db, item["product_id"], sharded[item["product_id"]], item["quantity"], session)
+                held.append(item)
+    except StockConflict:
+        if session is None:
+            for item in held:
+                await settle_sharded(db, item["product_id"], item["shards"], convert=False)
+        raise
+
+
+async def _settle_items(db, items, convert, session=None):
+    ops = _settle_ops(items, convert)
+    if ops:
+        await db.products.bulk_write(ops, ordered=False, session=session)
+    for item in items:
+        if "shards" in item:
+            await settle_sharded(db, item["product_id"], item["shards"], convert, session)
+
+
+async def place_order(db, quantities, order, sharded=None):
+    """
+    Hold stock for every ordered product and insert the order with its reservation, all or nothing.
+    A hold is a conditional increment of products.reserved_quantity that only matches while
+    stock_quantity - reserved_quantity covers the quantity, so concurrent checkouts can never
+    hold more than is on hand. Products with sharded stock are held on their shard documents
+    instead. The hold expires after RESERVATION_TTL_SECONDS unless the order is paid.
+    Args:
+        db: The database instance.
+        quantities (Dict[ObjectId, int]): Quantity to hold per product.
+        order (dict): The order document, with its `_id` already assigned.
+        sharded (Optional[Dict[ObjectId, int]]): Shard count of the products with sharded stock.
+    Raises:
+        StockConflict: A product no longer has enough available stock; nothing was changed.
+    """
+    sharded = sharded or {}
+    plain = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in sharded}
+    now = datetime.utcnow()
+    reservation = {
+        "_id": order["_id"],
+        "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()],
+        "status": ACTIVE,
+        "expires_at": now + timedelta(seconds=settings.RESERVATION_TTL_SECONDS),
+        "created_at": now,
+    }
+
+    async def write(session):
+        if plain:
+            result = await db.products.bulk_write(_hold_ops(plain), ordered=False, session=session)
+            if result.matched_count != len(plain):
+                raise StockConflict()
+        await _hold_sharded_items(db, reservation["items"], sharded, session)
+        await db.reservations.insert_one(reservation, session=session)
+        await db.orders.insert_one(order, session=session)
+
+    if await run_in_transaction(db, write):
+        return
+
+    # Without transactions each hold is tagged with the order id, so exactly the holds
+    # that were applied can be undone if another one or an insert fails. The tag is a
+    # string so product documents stay JSON-encodable while it is present.
+    tag = str(order["_id"])
+    if plain:
+        result = await db.products.bulk_write(_hold_ops(plain, tag), ordered=False)
+        if result.matched_count != len(plain):
+            await _undo_tagged_holds(db, plain, tag)
+            raise StockConflict()
+    try:
+        await _hold_sharded_items(db, reservation["items"], sharded)
+    except StockConflict:
+        await _undo_tagged_holds(db, plain, tag)
+        raise
+    try:
+        await db.reservations.insert_one(reservation)
+        await db.orders.insert_one(order)
+    except Exception:
+        await db.reservations.delete_one({"_id": reservation["_id"]})
+        await _undo_tagged_holds(db, plain, tag)
+        for item in reservation["items"]:
+            if "shards" in item:
+                await settle_sharded(db, item["product_id"], item["shards"], convert=False)
+        raise
+    if plain:
+        await db.products.update_many({"_id": {"$in": list(plain)}}, {"$pull": {"stock_holds": tag}})
+
+
+async def _restock_items(db, items, session=None):
+    for item in items:
+        await return_stock(db, item["product_id"], item["quantity"], session)
+
+
+async def _settle(db, order_id, status, apply, from_status=ACTIVE):
+    """Move a reservation from `from_status` to `status` and, if this call did, `await apply(items, session)`."""
+    now = datetime.utcnow()
+    close = {"$set": {"status": status, "closed_at": now, "purge_at": now + RETENTION}}
+    settled = None
+
+    async def write(session):
+        nonlocal settled
+        settled = await db.reservations.find_one_and_update(
+            {"_id": order_id, "status": from_status}, close, session=session
+        )
+        if settled:
+            await apply(settled["items"], session)
+
+    if not await run_in_transaction(db, write):
+        # The guarded status change makes sure only one caller settles the hold; a crash
+        # before the counter update is repaired by `manage.py reconcile-reservations`
+        settled = await db.reservations.find_one_and_update({"_id": order_id, "status": from_status}, close)
+        if settled:
+            await apply(settled["items"], None)
+    return settled is not None
+
+
+async def convert_reservation(db, order_id):
+    """
+    Turn an order's active hold into a real stock decrement once it is paid.
+    Returns:
+        bool: False if the order had no active hold (already settled, expired, or placed
+        before reservations existed, when stock was decremented at creation).
+    """
+    return await _settle(db, order_id, CONVERTED, lambda items, session: _settle_items(db, items, True, session))
+
+
+async def release_reservation(db, order_id, status=RELEASED):
+    """Give an order's held stock back; returns False if it had no active hold."""
+    return await _settle(db, order_id, status, lambda items, session: _settle_items(db, items, False, session))
+
+
+async def cancel_reservation(db, order_id):
+    """
+    Give a cancelled order's stock back: release its hold, or if it was already paid,
+    put the converted units back on hand.
+    Returns:
+        bool: False if there was nothing to give back.
+    """
+    if await release_reservation(db, order_id):
+        return True
+    return await _settle(
+        db, order_id, RESTOCKED, lambda items, session: _restock_items(db, items, session), from_status=CONVERTED
+    )
+
+
+async def release_expired_reservations(db, batch_size=None):
+    """
+    Release holds past their expiry and cancel their still-pending orders.
+    Returns:
+        int: Number of holds released.
+    """
+    cursor = db.reservations.find(
+        {"status": ACTIVE, "expires_at": {"$lt": datetime.utcnow()}}, {"_id": 1}
+    ).sort("expires_at", 1)
+    if batch_size:
+        cursor = cursor.limit(batch_size)
+
+    released = 0
+    async for reservation in cursor:
+        if await release_reservation(db, reservation["_id"], EXPIRED):
+            released += 1
+            await db.orders.update_one(
+                {"_id": reservation["_id"], "status": "pending"},
+                {"$set": {"status": "cancelled", "cancel_reason": "reservation_expired", "updated_at": datetime.utcnow()}}
+            )
+    return released
+
+
+async def reservation_sweeper(db, interval_seconds):
+    """Background loop started from the app lifespan."""
+    while True:
+        try:
+            released = await release_expired_reservations(db, batch_size=settings.RESERVATION_SWEEP_BATCH)
+            if released:
+                logger.info(f"Released {released} expired stock reservations")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Reservation sweep failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+async def rebuild_reserved_quantities(db):
+    """
+    Recompute products.reserved_quantity from the active reservations.
+    Returns:
+        int: Number of products whose counter changed.
+    """
+    rows = await db.reservations.aggregate([
+        {"$match": {"status": ACTIVE}},
+        {"$unwind": "$items"},
+        # Sharded holds live on the shard documents, see rebuild_shard_reserved
+        {"$match": {"items.shards": {"$exists": False}}},
+        {"$group": {"_id": "$items.product_id", "reserved": {"$sum": "$items.quantity"}}},
+    ]).to_list(None)
+    reserved = {row["_id"]: row["reserved"] for row in rows}
+
+    changed = 0
+    async for product in db.products.find(
+        {"$or": [{"_id": {"$in": list(reserved)}}, {"reserved_quantity": {"$nin": [0, None]}}]},
+        {"reserved_quantity": 1},
+    ):
+        expected = reserved.get(product["_id"], 0)
+        if product.get("reserved_quantity", 0) != expected:
+            await db.products.update_one({"_id": product["_id"]}, {"$set": {"reserved_quantity": expected}})
+            changed += 1
+    return changed
+
+
+async def clear_stale_hold_tags(db):
+    """
+    Remove hold tags left on products by checkouts that died before cleaning them up:
+    tags older than STALE_HOLD_TAG_AGE whose reservation is no longer active. Recent
+    tags may belong to a checkout still in progress and are kept.
+    Returns:
+        int: Number of products cleaned.
+    """
+    cutoff = datetime.now(timezone.utc) - STALE_HOLD_TAG_AGE
+    cleaned = 0
+    async for product in db.products.find({"stock_holds.0": {"$exists": True}}, {"stock_holds": 1}):
+        # Older tags were stored as ObjectIds
+        tags = {tag: ObjectId(str(tag)) for tag in product["stock_holds"] if ObjectId.is_valid(str(tag))}
+        active = {
+            reservation["_id"]
+            async for reservation in db.reservations.find({"_id": {"$in": list(tags.values())}, "status": ACTIVE}, {"_id": 1})
+        }
+        stale = [
+            tag for tag in product["stock_holds"]
+            if tag not in tags or (tags[tag] not in active and tags[tag].generation_time < cutoff)
+        ]
+        if stale:
+            await db.products.update_one({"_id": product["_id"]}, {"$pull": {"stock_holds": {"$in": stale}}})
+            cleaned += 1
+    return cleaned
+
+
+async def rebuild_shard_reserved(db):
+    """
+    Recompute stock_shards.reserved from the shard allocations of active reservations.
+    Returns:
+        int: Number of shards whose counter changed.
+    """
+    rows = await db.reservations.aggregate([
+        {"$match": {"status": ACTIVE}},
+        {"$unwind": "$items"},
+        {"$unwind": "$items.shards"},
+        {"$group": {
+            "_id": {"product_id": "$items.product_id", "shard": "$items.shards.shard"},
+            "reserved": {"$sum": "$items.shards.quantity"},
+        }},
+    ]).to_list(None)
+    reserved = {(row["_id"]["product_id"], row["_id"]["shard"]): row["reserved"] for row in rows}
+
+    changed = 0
+    async for shard in db.stock_shards.find({}, {"product_id": 1, "shard": 1, "reserved": 1}):
+        expected = reserved.get((shard["product_id"], shard["shard"]), 0)
+        if shard.get("reserved", 0) != expected:
+            await db.stock_shards.update_one({"_id": shard["_id"]}, {"$set": {"reserved": expected}})
+            changed += 1
+    return changed
@@ -0,0 +1,88 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+
+RATINGS = range(1, 6)
+
+def empty_review_stats():
+    """Counter fields a product document starts with before it has any reviews."""
+    return {
+        "rating_sum": 0,
+        "review_count": 0,
+        "rating_histogram": {str(rating): 0 for rating in RATINGS},
+    }
+
+def review_stats_inc(rating, sign=1):
+    """
+    Build the `$inc` document that adds (sign=1) or removes (sign=-1) one review.
+    Args:
+        rating (int): The review rating, 1-5.
+        sign (int): 1 when a review is added, -1 when it is removed.
+    Returns:
+        dict: The `$inc` update for the product document.
+    """
+    return {
+        "rating_sum": sign * rating,
+        "review_count": sign,
+        f"rating_histogram.{rating}": sign,
+    }
+
+def attach_review_stats(products):
+    """
+    Add average_rating and review_count to every product from its stored counters.
+    Args:
+        products (List[dict]): Product documents.
+    Returns:
+        List[dict]: The same products, updated in place.
+    """
+    for product in products:
+        count = product.get("review_count") or 0
+        rating_sum = product.get("rating_sum") or 0
+        product["average_rating"] = round(rating_sum / count, 2) if count else None
+        product["review_count"] = count
+    return products
+
+async def rebuild_review_stats(db, batch_size=500):
+    """
+    Recompute every product's rating counters from the reviews collection.
+    Args:
+        db: The database instance (should have 'reviews' and 'products' collections).
+        batch_size (int): Number of product updates sent per bulk write.
+    Returns:
+        int: Number of products that have at least one review.
+    """
+    rebuilt_at = datetime.utcnow()
+    group = {
+        "_id": "$product_id",
+        "rating_sum": {"$sum": "$rating"},
+        "review_count": {"$sum": 1},
+    }
+    for rating in RATINGS:
+        group[f"r{rating}"] = {"$sum": {"$cond": [{"$eq": ["$rating", rating]}, 1, 0]}}
+
+    reviewed = 0
+    updates = []
+    async for row in db.reviews.aggregate([{"$group": group}]):
+        updates.append(UpdateOne(
+            {"_id": ObjectId(row["_id"])},
+            {"$set": {
+                "rating_sum": row["rating_sum"],
+                "review_count": row["review_count"],
+                "rating_histogram": {str(rating): row[f"r{rating}"] for rating in RATINGS},
+                "review_stats_rebuilt_at": rebuilt_at,
+            }}
+        ))
+        if len(updates) >= batch_size:
+            await db.products.bulk_write(updates, ordered=False)
+            reviewed += len(updates)
+            updates = []
+    if updates:
+        await db.products.bulk_write(updates, ordered=False)
+        reviewed += len(updates)
+
+    # Products not touched above have no reviews left
+    await db.products.update_many(
+        {"review_stats_rebuilt_at": {"$ne": rebuilt_at}},
+        {"$set": {**empty_review_stats(), "review_stats_rebuilt_at": rebuilt_at}}
+    )
+    return reviewed
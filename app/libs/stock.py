@@ -0,0 +1,50 @@
+from pymongo.errors import OperationFailure
+from fastapi.logger import logger
+
+# Server error code for transactions on a standalone mongod (no replica set)
+ILLEGAL_OPERATION = 20
+
+_transactions_supported = True
+
+# Checkout bookkeeping kept on product documents; projected out of every product read
+HIDDEN_PRODUCT_FIELDS = {"stock_holds": 0}
+
+
+class StockConflict(Exception):
+    """A conditional stock update did not match: the product sold out or was deactivated meanwhile."""
+
+
+def available_quantity(product):
+    """On-hand stock minus the quantity held by active checkout reservations."""
+    return product.get("stock_quantity", 0) - product.get("reserved_quantity", 0)
+
+
+def available_at_least(quantity):
+    """Filter clause matching products with at least `quantity` units available."""
+    return {"$expr": {"$gte": [
+        {"$subtract": ["$stock_quantity", {"$ifNull": ["$reserved_quantity", 0]}]},
+        quantity,
+    ]}}
+
+
+async def run_in_transaction(db, write):
+    """
+    Await `write(session)` inside a multi-document transaction.
+    Transient write conflicts with concurrent transactions are retried by the driver.
+    Returns:
+        bool: False, with nothing written, when the deployment has no transaction
+        support (standalone mongod); the caller then runs its non-transactional path.
+    """
+    global _transactions_supported
+    if not _transactions_supported:
+        return False
+    try:
+        async with await db.client.start_session() as session:
+            await session.with_transaction(write)
+        return True
+    except OperationFailure as e:
+        if e.code != ILLEGAL_OPERATION:
+            raise
+        _transactions_supported = False
+        logger.warning("MongoDB transactions unavailable, using compensating stock updates")
+        return False
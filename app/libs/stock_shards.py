@@ -0,0 +1,290 @@
+import asyncio
+import random
+from datetime import datetime
+from pymongo import UpdateOne
+from fastapi.logger import logger
+from app.libs.stock import StockConflict, available_quantity, run_in_transaction
+
+# Opt-in for hot products: the product's stock lives in `stock_shards` documents
+# {_id: "<product_id>:<i>", product_id, shard, stock, reserved} instead of the
+# product document, so concurrent holds update different documents. products.stock_shards
+# holds the shard count; each shard is a small copy of the unsharded model, with
+# available = stock - reserved.
+
+
+def _shard_id(product_id, shard):
+    return f"{product_id}:{shard}"
+
+
+def _available_at_least(quantity):
+    return {"$expr": {"$gte": [{"$subtract": ["$stock", "$reserved"]}, quantity]}}
+
+
+def _split(total, shards):
+    return [total // shards + (1 if i < total % shards else 0) for i in range(shards)]
+
+
+def is_sharded(product):
+    return bool(product.get("stock_shards"))
+
+
+async def enable_stock_shards(db, product_id, shards):
+    """
+    Move a product's stock into `shards` shard documents.
+    Only done while no checkout holds the product: open reservations settle their holds
+    on the counters they were taken from, so reserved units cannot move with the stock.
+    Meant for a quiet moment before a sale; checkouts of the product fail with a conflict
+    while the counters are being moved.
+    Returns:
+        bool: False if the product is missing, already sharded, or has held units.
+    """
+    now = datetime.utcnow()
+    # Marking the product first stops new holds on the product document
+    product = await db.products.find_one_and_update(
+        {"_id": product_id, "stock_shards": {"$exists": False}, "reserved_quantity": {"$in": [0, None]}},
+        {"$set": {"stock_shards": shards, "updated_at": now}},
+    )
+    if not product:
+        return False
+    stock = _split(product.get("stock_quantity", 0), shards)
+    await db.stock_shards.insert_many([
+        {"_id": _shard_id(product_id, i), "product_id": product_id, "shard": i,
+         "stock": stock[i], "reserved": 0, "updated_at": now}
+        for i in range(shards)
+    ])
+    return True
+
+
+async def disable_stock_shards(db, product_id):
+    """
+    Fold the shard counters back into the product document.
+    Only done while no checkout holds units on the shards, for the same reason as in
+    `enable_stock_shards`; each shard is removed only if nothing is held on it, and
+    the removed shards are put back if another one still has holds.
+    Returns:
+        bool: False if the product is not sharded or has held units.
+    """
+    removed = []
+    for doc in await db.stock_shards.find({"product_id": product_id}, {"_id": 1}).to_list(None):
+        shard = await db.stock_shards.find_one_and_delete({"_id": doc["_id"], "reserved": 0})
+        if shard is None:
+            if removed:
+                await db.stock_shards.insert_many(removed)
+            return False
+        removed.append(shard)
+    if not removed:
+        return False
+    await db.products.update_one(
+        {"_id": product_id},
+        {"$set": {"stock_quantity": sum(shard["stock"] for shard in removed), "reserved_quantity": 0,
+                  "updated_at": datetime.utcnow()},
+         "$unset": {"stock_shards": ""}}
+    )
+    return True
+
+
+async def shard_totals(db, product_ids):
+    """
+    Summed counters for sharded products.
+    Returns:
+        Dict[ObjectId, Tuple[int, int]]: Product id -> (stock, reserved).
+    """
+    rows = await db.stock_shards.aggregate([
+        {"$match": {"product_id": {"$in": list(product_ids)}}},
+        {"$group": {"_id": "$product_id", "stock": {"$sum": "$stock"}, "reserved": {"$sum": "$reserved"}}},
+    ]).to_list(None)
+    return {row["_id"]: (row["stock"], row["reserved"]) for row in rows}
+
+
+async def attach_stock(db, products):
+    """
+    Give product documents the stock fields the read APIs report: sharded products get
+    the summed shard values as stock_quantity and reserved_quantity, and every product
+    gets available_quantity, the on-hand stock not held by open checkouts.
+    Costs one aggregation, and only when a sharded product is present.
+    """
+    sharded = [product for product in products if is_sharded(product)]
+    if sharded:
+        totals = await shard_totals(db, {product["_id"] for product in sharded})
+        for product in sharded:
+            stock, reserved = totals.get(product["_id"], (0, 0))
+            product["stock_quantity"] = stock
+            product["reserved_quantity"] = reserved
+            product.pop("stock_shards", None)
+    for product in products:
+        product["available_quantity"] = max(available_quantity(product), 0)
+    return products
+
+
+async def _take(db, product_id, shard, quantity, session):
+    result = await db.stock_shards.update_one(
+        {"_id": _shard_id(product_id, shard), **_available_at_least(quantity)},
+        {"$inc": {"reserved": quantity}},
+        session=session,
+    )
+    return result.modified_count == 1
+
+
+async def hold_sharded(db, product_id, shards, quantity, session=None):
+    """
+    Hold `quantity` units of a sharded product.
+    Shards are tried in random order so concurrent checkouts spread over the documents;
+    an empty shard falls through to the next. If no single shard can cover the quantity,
+    it is taken piecewise from the shards that have units left.
+    Returns:
+        List[dict]: Allocations [{"shard", "quantity"}], stored with the reservation.
+    Raises:
+        StockConflict: The shards together do not have `quantity` units available.
+    """
+    order = random.sample(range(shards), shards)
+    for shard in order:
+        if await _take(db, product_id, shard, quantity, session):
+            return [{"shard": shard, "quantity": quantity}]
+
+    allocations = []
+    remaining = quantity
+    docs = await db.stock_shards.find({"product_id": product_id}, session=session).to_list(None)
+    available = {doc["shard"]: doc["stock"] - doc["reserved"] for doc in docs}
+    for shard in order:
+        take = min(available.get(shard, 0), remaining)
+        if take > 0 and await _take(db, product_id, shard, take, session):
+            allocations.append({"shard": shard, "quantity": take})
+            remaining -= take
+        if not remaining:
+            return allocations
+
+    if allocations:
+        await settle_sharded(db, product_id, allocations, convert=False, session=session)
+    raise StockConflict()
+
+
+async def settle_sharded(db, product_id, allocations, convert, session=None):
+    """Close held allocations: release them, or also take the units off the shards' stock."""
+    ops = []
+    for allocation in allocations:
+        update = {"reserved": -allocation["quantity"]}
+        if convert:
+            update["stock"] = -allocation["quantity"]
+        ops.append(UpdateOne({"_id": _shard_id(product_id, allocation["shard"])}, {"$inc": update}))
+    await db.stock_shards.bulk_write(ops, ordered=False, session=session)
+
+
+async def return_stock(db, product_id, quantity, session=None):
+    """
+    Put sold units back on hand (a paid order was cancelled), on the shards if the
+    product is sharded now, whatever its mode was when the units were taken.
+    """
+    product = await db.products.find_one({"_id": product_id}, {"stock_shards": 1}, session=session)
+    if product and is_sharded(product):
+        await db.stock_shards.bulk_write([
+            UpdateOne({"_id": _shard_id(product_id, shard)}, {"$inc": {"stock": units}})
+            for shard, units in enumerate(_split(quantity, product["stock_shards"])) if units
+        ], ordered=False, session=session)
+    else:
+        await db.products.update_one({"_id": product_id}, {"$inc": {"stock_quantity": quantity}}, session=session)
+
+
+async def adjust_sharded_stock(db, product_id, shards, stock_quantity):
+    """
+    Set the on-hand stock of a sharded product (merchant stock updates).
+    Added units are split over the shards; removed units are taken from shards with spare units.
+    Raises:
+        StockConflict: The new stock is below the quantity currently held by checkouts.
+    """
+    stock, reserved = (await shard_totals(db, [product_id])).get(product_id, (0, 0))
+    delta = stock_quantity - stock
+    if delta > 0:
+        await db.stock_shards.bulk_write([
+            UpdateOne({"_id": _shard_id(product_id, shard)}, {"$inc": {"stock": units}})
+            for shard, units in enumerate(_split(delta, shards)) if units
+        ], ordered=False)
+    elif delta < 0:
+        removed = await _drain(db, product_id, -delta)
+        if removed < -delta:
+            await db.stock_shards.update_one({"_id": _shard_id(product_id, 0)}, {"$inc": {"stock": removed}})
+            raise StockConflict()
+    await rebalance_stock_shards(db, product_id)
+
+
+async def _drain(db, product_id, quantity):
+    """Remove up to `quantity` unheld units from the shards, richest first; returns the units removed."""
+    removed = 0
+    docs = await db.stock_shards.find({"product_id": product_id}).to_list(None)
+    for doc in sorted(docs, key=lambda doc: doc["reserved"] - doc["stock"]):
+        if removed >= quantity:
+            continue
+        take = min(doc["stock"] - doc["reserved"], quantity - removed)
+        if take <= 0:
+            continue
+        result = await db.stock_shards.update_one(
+            {"_id": doc["_id"], **_available_at_least(take)}, {"$inc": {"stock": -take}}
+        )
+        if result.modified_count:
+            removed += take
+    return removed
+
+
+async def _move(db, product_id, source, target, quantity):
+    """Move unheld units between two shards in one transaction; False if the source no longer has them."""
+    async def write(session):
+        result = await db.stock_shards.update_one(
+            {"_id": _shard_id(product_id, source), **_available_at_least(quantity)},
+            {"$inc": {"stock": -quantity}},
+            session=session,
+        )
+        if not result.modified_count:
+            raise StockConflict()
+        await db.stock_shards.update_one(
+            {"_id": _shard_id(product_id, target)}, {"$inc": {"stock": quantity}}, session=session
+        )
+
+    try:
+        return await run_in_transaction(db, write)
+    except StockConflict:
+        return False
+
+
+async def rebalance_stock_shards(db, product_id):
+    """
+    Even out the available units across a product's shards so holds keep landing on
+    the first shard they try. Each move takes the units off one shard and adds them to
+    another in a single transaction, so units are never lost or double counted. Without
+    transaction support (standalone mongod) nothing is moved; holds still fall through
+    to shards with units left.
+    Returns:
+        int: Units moved.
+    """
+    docs = await db.stock_shards.find({"product_id": product_id}).to_list(None)
+    if not docs:
+        return 0
+    available = {doc["shard"]: doc["stock"] - doc["reserved"] for doc in docs}
+    targets = dict(zip(sorted(available), _split(sum(available.values()), len(available))))
+    surplus = {shard: units - targets[shard] for shard, units in available.items() if units > targets[shard]}
+    deficit = {shard: targets[shard] - units for shard, units in available.items() if units < targets[shard]}
+
+    moved = 0
+    for source in surplus:
+        for target in deficit:
+            quantity = min(surplus[source], deficit[target])
+            if not quantity:
+                continue
+            if not await _move(db, product_id, source, target, quantity):
+                # Drained by holds meanwhile, or no transactions: leave the rest for the next run
+                return moved
+            surplus[source] -= quantity
+            deficit[target] -= quantity
+            moved += quantity
+    return moved
+
+
+async def stock_shard_rebalancer(db, interval_seconds):
+    """Background loop started from the app lifespan."""
+    while True:
+        try:
+            async for product in db.products.find({"stock_shards": {"$gt": 0}}, {"_id": 1}):
+                await rebalance_stock_shards(db, product["_id"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Stock shard rebalance failed: {e}")
+        await asyncio.sleep(interval_seconds)
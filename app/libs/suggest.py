@@ -0,0 +1,169 @@
+import asyncio
+import bisect
+import heapq
+import time
+from collections import OrderedDict
+import unicodedata
+from fastapi.logger import logger
+from app.core.config import settings
+from app.libs.category_utils import category_index
+from app.libs.metrics import histogram
+
+PRODUCT = "product"
+CATEGORY = "category"
+
+MAX_SUGGESTIONS = 20
+# Prefixes matching at least this many entries are memoized; smaller ranges are cheap to scan
+MEMO_MIN_RANGE = 256
+MEMO_SIZE = 10000
+
+suggest_latency = histogram("suggest_latency_ms", buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+
+
+def normalize(text):
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def name_keys(name):
+    """The normalized name from every word onwards, so "leather wallet" is found by "wal" too."""
+    words = normalize(name).split(" ")
+    return {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class SuggestIndex:
+    """
+    In-memory typeahead over active product and category names.
+    Every name is stored under several keys (see `name_keys`) in one sorted array of
+    (key, ref) pairs, so a prefix lookup is two binary searches plus a scan of the
+    matching range. Products are weighted by review count and categories by their
+    number of active products. The product routes update the array in place; a full
+    rebuild runs in the background once the index is older than SUGGEST_INDEX_TTL_SECONDS
+    so writes made through other workers are picked up.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.loaded_at = None
+        self._entries = []
+        self._docs = {}
+        self._category_counts = {}
+        self._category_version = None
+        self._memo = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._reload = None
+
+    def _forget(self, text):
+        """Drop memoized results for prefixes of any key of `text`."""
+        keys = name_keys(text)
+        for prefix in [prefix for prefix in self._memo if any(key.startswith(prefix) for key in keys)]:
+            del self._memo[prefix]
+
+    def _insert(self, ref, text, weight):
+        self._forget(text)
+        self._docs[ref] = {"type": ref[0], "id": ref[1], "text": text, "weight": weight}
+        for key in name_keys(text):
+            bisect.insort(self._entries, (key, ref))
+
+    def _remove(self, ref):
+        doc = self._docs.pop(ref, None)
+        if doc is None:
+            return
+        self._forget(doc["text"])
+        for key in name_keys(doc["text"]):
+            i = bisect.bisect_left(self._entries, (key, ref))
+            if i < len(self._entries) and self._entries[i] == (key, ref):
+                del self._entries[i]
+
+    async def load(self, db):
+        products = await db.products.find(
+            {"is_active": True}, {"name": 1, "review_count": 1, "category_id": 1}
+        ).to_list(None)
+        await category_index.ensure_loaded(db)
+
+        docs, entries, counts = {}, [], {}
+        for product in products:
+            if not product.get("name"):
+                continue
+            ref = (PRODUCT, str(product["_id"]))
+            docs[ref] = {"type": PRODUCT, "id": ref[1], "text": product["name"], "weight": product.get("review_count", 0)}
+            entries.extend((key, ref) for key in name_keys(product["name"]))
+            counts[product.get("category_id")] = counts.get(product.get("category_id"), 0) + 1
+        entries.sort()
+
+        self._entries, self._docs, self._category_counts = entries, docs, counts
+        self._memo.clear()
+        self._category_version = None
+        self._load_categories()
+        self.loaded_at = time.monotonic()
+
+    def _load_categories(self):
+        self._memo.clear()
+        for ref in [ref for ref in self._docs if ref[0] == CATEGORY]:
+            self._remove(ref)
+        for category in category_index.categories.values():
+            if category.get("is_active", True) and category.get("name"):
+                self._insert(
+                    (CATEGORY, str(category["_id"])), category["name"], self._category_counts.get(category["_id"], 0)
+                )
+        self._category_version = category_index.version
+
+    async def _background_reload(self, db):
+        try:
+            await self.load(db)
+        except Exception as e:
+            logger.warning(f"Suggest index reload failed: {e}")
+
+    async def ensure_loaded(self, db):
+        """Load on first use; afterwards serve the current index while a stale one is rebuilt."""
+        if self.loaded_at is None:
+            async with self._lock:
+                if self.loaded_at is None:
+                    await self.load(db)
+        elif time.monotonic() - self.loaded_at > self.ttl_seconds and (self._reload is None or self._reload.done()):
+            self._reload = asyncio.create_task(self._background_reload(db))
+
+        await category_index.ensure_loaded(db)
+        if self._category_version != category_index.version:
+            self._load_categories()
+
+    def upsert_product(self, product):
+        """Reflect a created or updated product document; inactive products are removed."""
+        if self.loaded_at is None:
+            return
+        ref = (PRODUCT, str(product["_id"]))
+        self._remove(ref)
+        if product.get("is_active", True) and product.get("name"):
+            self._insert(ref, product["name"], product.get("review_count", 0))
+
+    def remove_product(self, product_id):
+        self._remove((PRODUCT, str(product_id)))
+
+    def suggest(self, text, limit):
+        """
+        Most popular names with a word starting with `text`.
+        Returns:
+            List[dict]: Up to `limit` {"type", "id", "text"} suggestions, best first.
+        """
+        started = time.perf_counter()
+        prefix = normalize(text)
+        results = self._memo.get(prefix)
+        if results is not None:
+            self._memo.move_to_end(prefix)
+        else:
+            lo = bisect.bisect_left(self._entries, (prefix,))
+            hi = bisect.bisect_left(self._entries, (prefix + "\uffff",), lo)
+            refs = {ref for _, ref in self._entries[lo:hi]}
+            best = heapq.nsmallest(
+                MAX_SUGGESTIONS, refs, key=lambda ref: (-self._docs[ref]["weight"], len(self._docs[ref]["text"]), ref)
+            )
+            results = [{key: self._docs[ref][key] for key in ("type", "id", "text")} for ref in best]
+            if hi - lo >= MEMO_MIN_RANGE:
+                self._memo[prefix] = results
+                if len(self._memo) > MEMO_SIZE:
+                    self._memo.popitem(last=False)
+        results = results[:limit]
+        suggest_latency.observe((time.perf_counter() - started) * 1000)
+        return results
+
+
+suggest_index = SuggestIndex(ttl_seconds=settings.SUGGEST_INDEX_TTL_SECONDS)
@@ -0,0 +1,52 @@
+from bson import ObjectId
+from app.core.config import settings
+from app.libs.chromadb import search_embedding
+from app.libs.inference import inference
+
+
+def vector_where(category_ids=None, min_price=None, max_price=None):
+    """
+    Translate the product list filters into a Chroma `where` clause over the
+    metadata written by `product_metadata`.
+    Args:
+        category_ids (Optional[List[ObjectId]]): Allowed categories, descendants included.
+        min_price (Optional[float]): Inclusive lower price bound.
+        max_price (Optional[float]): Inclusive upper price bound.
+    Returns:
+        Optional[dict]: The where clause, None without filters.
+    """
+    # No is_active or merchant_id clause: vectors written before those keys were stored
+    # lack them, which Chroma treats as not matching, and the Mongo query filters both anyway
+    conditions = []
+    if category_ids is not None:
+        conditions.append({"category_id": {"$in": [str(category_id) for category_id in category_ids]}})
+    if min_price is not None:
+        conditions.append({"price": {"$gte": float(min_price)}})
+    if max_price is not None:
+        conditions.append({"price": {"$lte": float(max_price)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+async def filtered_vector_search(db, embedding, query, where, limit):
+    """
+    Nearest products that satisfy both the Chroma `where` clause and the Mongo query.
+    Chroma applies the filters itself, so one query normally fills the page; the
+    over-fetch only covers vectors whose product changed since it was indexed.
+    When Mongo still drops results, the query is repeated with twice as many
+    neighbours until `limit` products survive, Chroma runs out of matches or
+    VECTOR_SEARCH_MAX_RESULTS is reached.
+    Returns:
+        List[ObjectId]: Up to `limit` product ids, nearest first.
+    """
+    n_results = min(limit * settings.VECTOR_SEARCH_OVERFETCH, settings.VECTOR_SEARCH_MAX_RESULTS)
+    while True:
+        ids = [ObjectId(_id) for _id in await inference.run(search_embedding, embedding, n_results, where)]
+        matched = {
+            doc["_id"] async for doc in db.products.find({"$and": [query, {"_id": {"$in": ids}}]}, {"_id": 1})
+        }
+        ranked = [_id for _id in ids if _id in matched]
+        if len(ranked) >= limit or len(ids) < n_results or n_results >= settings.VECTOR_SEARCH_MAX_RESULTS:
+            return ranked[:limit]
+        n_results = min(n_results * 2, settings.VECTOR_SEARCH_MAX_RESULTS)
@@ -1,14 +1,88 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, HTTPException, UploadFile,status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from fastapi.logger import logger
 
 from app.api.v1 import auth, users, merchants, products, categories, orders, livekit
 from app.core.config import settings
+from app.db.database import db
+from app.db.indexes import ensure_indexes
 from app.libs.cloudinary import upload_image 
-# from app.libs.chromadb import collection
+from app.libs.category_utils import category_index
+from app.libs.suggest import suggest_index
+from app.libs.chromadb import vector_store, load_query_embedding_cache, save_query_embedding_cache
+from app.libs.inference import inference
+from app.libs import metrics
+from app.libs.related_products import related_products_refresher
+from app.libs.indexing import indexing_worker
+from app.libs.reservations import reservation_sweeper
+from app.libs.stock_shards import stock_shard_rebalancer
+from app.libs.image_embeddings import close_http_client
+
+def log_warmup_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Vector store warmup failed: {task.exception()}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.ENSURE_INDEXES_ON_STARTUP:
+        try:
+            for collection_name, error in (await ensure_indexes(db)).items():
+                logger.error(f"Could not build indexes on {collection_name}: {error}")
+        except Exception as e:
+            logger.warning(f"Indexes not ensured at startup: {e}")
+    try:
+        await category_index.load(db)
+    except Exception as e:
+        # The index is loaded lazily on first use if the database is not reachable yet
+        logger.warning(f"Category index not loaded at startup: {e}")
+    try:
+        await suggest_index.load(db)
+    except Exception as e:
+        logger.warning(f"Suggest index not loaded at startup: {e}")
+
+    try:
+        load_query_embedding_cache(settings.QUERY_EMBEDDING_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"Query embedding cache not loaded: {e}")
+
+    # Load the embedding model in the background so non-search routes serve immediately
+    warmup = None
+    if settings.VECTOR_STORE_WARMUP:
+        warmup = asyncio.create_task(vector_store.ensure_started())
+        warmup.add_done_callback(log_warmup_failure)
+    background_tasks = [asyncio.create_task(indexing_worker(db)) for _ in range(settings.INDEXING_WORKERS)]
+    if settings.RELATED_PRODUCTS_REFRESH_INTERVAL_SECONDS:
+        background_tasks.append(asyncio.create_task(
+            related_products_refresher(db, settings.RELATED_PRODUCTS_REFRESH_INTERVAL_SECONDS)
+        ))
+    if settings.RESERVATION_SWEEP_INTERVAL_SECONDS:
+        background_tasks.append(asyncio.create_task(
+            reservation_sweeper(db, settings.RESERVATION_SWEEP_INTERVAL_SECONDS)
+        ))
+    if settings.STOCK_SHARD_REBALANCE_INTERVAL_SECONDS:
+        background_tasks.append(asyncio.create_task(
+            stock_shard_rebalancer(db, settings.STOCK_SHARD_REBALANCE_INTERVAL_SECONDS)
+        ))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    if warmup and not warmup.done():
+        warmup.cancel()
+    try:
+        save_query_embedding_cache(settings.QUERY_EMBEDDING_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"Query embedding cache not saved: {e}")
+    await close_http_client()
+    inference.shutdown()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description="E-commerce API with FastAPI and MongoDB",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Set up CORS
@@ -18,6 +92,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Include routers
@@ -42,6 +117,28 @@ async def handle_upload(image: UploadFile=File(...)):
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e)
 
+@app.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness():
+    if vector_store.error is not None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "failed", "detail": f"Vector store failed to start: {vector_store.error}"},
+        )
+    if not vector_store.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "starting", "detail": "Vector store warming up"},
+        )
+    return {"status": "ready"}
+
+@app.get("/metrics")
+def read_metrics():
+    return {"inference_in_flight": inference.in_flight, **metrics.snapshot()}
+
 @app.get("/")
 def root():
     return {"message": "Welcome to E-commerce API"}
\ No newline at end of file
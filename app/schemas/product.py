@@ -34,5 +34,6 @@ class ProductOut(ProductBase):
     id: str = Field(alias="_id")
     category_id: str
     merchant_id: str
+    available_quantity: Optional[int] = None
     average_rating: Optional[float] = None
     review_count: Optional[int] = None
@@ -0,0 +1,98 @@
+"""
+Compare the embedding backends on this machine.
+
+    python -m benchmarks.embedding_backends --backends torch,onnx,onnx-int8 --threads 4
+
+Reports model load time, image throughput (images/sec at the given batch size),
+single text query latency (p50/p95) and the mean cosine similarity of each
+backend's image embeddings to the torch reference, so quantization loss is visible.
+ONNX backends need `python manage.py export-onnx` first.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.libs.embeddings import BACKENDS, TORCH, create_embedding_function
+
+QUERIES = ["running shoes", "iphone case", "red cotton t-shirt", "wireless headphones", "wooden dining table"]
+
+
+def synthetic_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_backend(backend, images, batch_size, query_rounds):
+    started = time.perf_counter()
+    embedding_function = create_embedding_function(settings, backend=backend)
+    load_seconds = time.perf_counter() - started
+
+    # Warm up both encoders before timing
+    embedding_function.encode_images(images[:1])
+    embedding_function.encode_texts(QUERIES[:1])
+
+    started = time.perf_counter()
+    image_embeddings = []
+    for i in range(0, len(images), batch_size):
+        image_embeddings.extend(embedding_function.encode_images(images[i:i + batch_size]))
+    images_per_second = len(images) / (time.perf_counter() - started)
+
+    latencies = []
+    for _ in range(query_rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            embedding_function.encode_texts([query])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "load_s": load_seconds,
+        "images_per_s": images_per_second,
+        "query_p50_ms": statistics.median(latencies),
+        "query_p95_ms": percentile(latencies, 95),
+        "image_embeddings": np.stack(image_embeddings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--query-rounds", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=settings.EMBEDDING_THREADS)
+    parser.add_argument("--device", default=settings.EMBEDDING_DEVICE)
+    args = parser.parse_args()
+
+    settings.EMBEDDING_THREADS = args.threads
+    settings.EMBEDDING_DEVICE = args.device
+    images = synthetic_images(args.images)
+
+    results = {}
+    for backend in args.backends.split(","):
+        try:
+            results[backend] = run_backend(backend, images, args.batch_size, args.query_rounds)
+        except Exception as e:
+            print(f"{backend}: skipped ({e})")
+
+    reference = results.get(TORCH, {}).get("image_embeddings")
+    print(f"{'backend':<12}{'load s':>9}{'img/s':>10}{'q p50 ms':>11}{'q p95 ms':>11}{'cos vs torch':>14}")
+    for backend, result in results.items():
+        agreement = "-"
+        if reference is not None:
+            agreement = f"{float(np.mean(np.sum(reference * result['image_embeddings'], axis=1))):.4f}"
+        print(
+            f"{backend:<12}{result['load_s']:>9.2f}{result['images_per_s']:>10.1f}"
+            f"{result['query_p50_ms']:>11.2f}{result['query_p95_ms']:>11.2f}{agreement:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
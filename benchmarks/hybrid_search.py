@@ -0,0 +1,175 @@
+"""
+Relevance and latency of keyword, vector and hybrid (RRF) product search.
+
+    python -m benchmarks.hybrid_search --products 5000 --rounds 3
+
+Builds a synthetic catalog in a scratch Mongo database (MONGO_URI, --db) with the
+products text index. Product names and descriptions are embedded with the configured
+embedding backend. Two query sets are run: literal queries that reuse catalog words
+("red leather wallet") and paraphrased queries that use synonyms ("crimson billfold").
+A product is relevant when it has the query's colour and item type. Reports recall@10,
+nDCG@10, MRR and p50/p95 latency per retriever. The scratch database is dropped afterwards.
+"""
+import argparse
+import asyncio
+import math
+import random
+import statistics
+import time
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.db.indexes import INDEXES
+from app.libs.embeddings import create_embedding_function
+from app.libs.hybrid_search import hydrate_page, keyword_search, reciprocal_rank_fusion
+
+# colour -> synonyms used only by the paraphrased queries and a share of the catalog
+COLORS = {
+    "red": ["crimson", "scarlet"],
+    "blue": ["navy", "azure"],
+    "black": ["ebony", "jet"],
+    "green": ["olive", "emerald"],
+    "white": ["ivory", "snow"],
+}
+# item -> synonyms
+ITEMS = {
+    "sneakers": ["trainers", "running shoes"],
+    "wallet": ["billfold", "purse"],
+    "backpack": ["rucksack", "daypack"],
+    "headphones": ["earphones", "headset"],
+    "t-shirt": ["tee", "crew neck top"],
+    "watch": ["wristwatch", "timepiece"],
+    "sofa": ["couch", "settee"],
+    "lamp": ["lantern", "desk light"],
+}
+MATERIALS = ["leather", "cotton", "canvas", "steel", "wooden", "wool", "plastic"]
+ADJECTIVES = ["classic", "lightweight", "premium", "compact", "durable", "minimal"]
+TOP_K = 10
+
+
+def synthetic_catalog(count, seed=0):
+    rng = random.Random(seed)
+    products = []
+    for _ in range(count):
+        color, item = rng.choice(list(COLORS)), rng.choice(list(ITEMS))
+        # A third of the catalog is described with synonyms only, which keyword search cannot match literally
+        shown_color = rng.choice(COLORS[color]) if rng.random() < 0.33 else color
+        shown_item = rng.choice(ITEMS[item]) if rng.random() < 0.33 else item
+        products.append({
+            "name": f"{rng.choice(ADJECTIVES)} {shown_color} {rng.choice(MATERIALS)} {shown_item}",
+            "description": f"A {rng.choice(ADJECTIVES)} {shown_item} in {shown_color}, made for everyday use.",
+            "color": color,
+            "item": item,
+            "is_active": True,
+        })
+    return products
+
+
+def query_sets(seed=0):
+    rng = random.Random(seed)
+    literal, paraphrased = [], []
+    for color in COLORS:
+        for item in ITEMS:
+            literal.append((f"{color} {item}", color, item))
+            paraphrased.append((f"{rng.choice(COLORS[color])} {rng.choice(ITEMS[item])}", color, item))
+    return {"literal": literal, "paraphrased": paraphrased}
+
+
+def relevance_metrics(ranked_ids, relevant):
+    hits = [1 if _id in relevant else 0 for _id in ranked_ids[:TOP_K]]
+    ideal = sum(1 / math.log2(i + 2) for i in range(min(len(relevant), TOP_K)))
+    dcg = sum(hit / math.log2(i + 2) for i, hit in enumerate(hits))
+    first = next((i for i, hit in enumerate(hits) if hit), None)
+    return {
+        "recall@10": sum(hits) / min(len(relevant), TOP_K) if relevant else 0.0,
+        "ndcg@10": dcg / ideal if ideal else 0.0,
+        "mrr": 1 / (first + 1) if first is not None else 0.0,
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class VectorIndex:
+    """Brute-force cosine search over text embeddings, standing in for the Chroma collection."""
+
+    def __init__(self, embedding_function, ids, texts, batch_size=256):
+        self.embedding_function = embedding_function
+        self.ids = ids
+        self.matrix = np.concatenate([
+            embedding_function.encode_texts(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)
+        ])
+
+    def search(self, text, n_results):
+        scores = self.matrix @ self.embedding_function.encode_texts([text])[0]
+        top = np.argsort(-scores)[:n_results]
+        return [self.ids[i] for i in top]
+
+
+async def run(args):
+    db = AsyncIOMotorClient(settings.MONGO_URI)[args.db]
+    await db.products.drop()
+    try:
+        catalog = synthetic_catalog(args.products)
+        result = await db.products.insert_many(catalog)
+        await db.products.create_indexes(INDEXES["products"])
+        ids = result.inserted_ids
+        relevant_by_key = {}
+        for _id, product in zip(ids, catalog):
+            relevant_by_key.setdefault((product["color"], product["item"]), set()).add(_id)
+
+        print(f"Embedding {len(catalog)} products with {settings.EMBEDDING_BACKEND}...")
+        vectors = VectorIndex(
+            create_embedding_function(settings), ids, [f"{p['name']}. {p['description']}" for p in catalog]
+        )
+        n_results = settings.HYBRID_SEARCH_CANDIDATES
+
+        async def keyword(text):
+            return await keyword_search(db, text, {"is_active": True}, n_results)
+
+        async def vector(text):
+            return vectors.search(text, n_results)
+
+        async def hybrid(text):
+            keyword_ids = await keyword_search(db, text, {"is_active": True}, n_results)
+            fused = reciprocal_rank_fusion([keyword_ids, vectors.search(text, n_results)])
+            await hydrate_page(db, fused[:TOP_K])
+            return fused
+
+        retrievers = {"keyword": keyword, "vector": vector, "hybrid": hybrid}
+        print(f"{'queries':<13}{'retriever':<10}{'recall@10':>11}{'ndcg@10':>9}{'mrr':>7}{'p50 ms':>9}{'p95 ms':>9}")
+        for set_name, queries in query_sets().items():
+            for name, retrieve in retrievers.items():
+                metrics, latencies = [], []
+                for _ in range(args.rounds):
+                    for text, color, item in queries:
+                        started = time.perf_counter()
+                        ranked = await retrieve(text)
+                        latencies.append((time.perf_counter() - started) * 1000)
+                        metrics.append(relevance_metrics(ranked, relevant_by_key.get((color, item), set())))
+                means = {key: statistics.mean(m[key] for m in metrics) for key in metrics[0]}
+                print(
+                    f"{set_name:<13}{name:<10}{means['recall@10']:>11.3f}{means['ndcg@10']:>9.3f}{means['mrr']:>7.3f}"
+                    f"{statistics.median(latencies):>9.2f}{percentile(latencies, 95):>9.2f}"
+                )
+    finally:
+        if not args.keep:
+            await db.client.drop_database(args.db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--db", default="hybrid_search_benchmark", help="Scratch database, dropped afterwards")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Flash-sale contention on checkout stock reservations.
+
+    python -m benchmarks.reservation_contention --buyers 500 --stock 100 --concurrency 100
+    python -m benchmarks.reservation_contention --buyers 500 --stock 100 --concurrency 100 --shards 8
+
+Creates one product with --stock units in a scratch Mongo database (MONGO_URI, --db) and
+lets --buyers checkouts race for it through `place_order`, at most --concurrency at a
+time. Half of the successful orders are then paid and the rest cancelled. Reports
+throughput, hold latency p50/p95, how many checkouts won or lost, and checks that no
+unit was oversold and that the counters settle back to a consistent state. Uses
+transactions on a replica set and the compensating path on a standalone server.
+With --shards the product's stock is split into that many shard counters first.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.libs import stock
+from app.libs.reservations import convert_reservation, place_order, release_reservation
+from app.libs.stock import StockConflict
+from app.libs.stock_shards import attach_stock, enable_stock_shards
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args):
+    db = AsyncIOMotorClient(settings.MONGO_URI)[args.db]
+    await db.client.drop_database(args.db)
+    try:
+        product_id = ObjectId()
+        await db.products.insert_one({
+            "_id": product_id, "name": "Flash sale item", "price": 10.0,
+            "stock_quantity": args.stock, "reserved_quantity": 0, "is_active": True,
+        })
+        sharded = {}
+        if args.shards:
+            await enable_stock_shards(db, product_id, args.shards)
+            sharded = {product_id: args.shards}
+
+        async def load_product():
+            product = await db.products.find_one({"_id": product_id})
+            return (await attach_stock(db, [product]))[0]
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, won, lost = [], [], 0
+
+        async def checkout():
+            nonlocal lost
+            order = {"_id": ObjectId(), "status": "pending", "items": [{"product_id": str(product_id), "quantity": args.quantity}]}
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await place_order(db, {product_id: args.quantity}, order, sharded)
+                    won.append(order["_id"])
+                except StockConflict:
+                    lost += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout() for _ in range(args.buyers)))
+        elapsed = time.perf_counter() - started
+
+        product = await load_product()
+        held = product["reserved_quantity"]
+        print(f"mode: {'transactions' if stock._transactions_supported else 'compensating writes'}")
+        print(f"checkouts: {args.buyers} in {elapsed:.2f}s ({args.buyers / elapsed:.0f}/s), won {len(won)}, lost {lost}")
+        print(f"hold latency ms: p50 {statistics.median(latencies):.2f}, p95 {percentile(latencies, 95):.2f}")
+        print(f"held {held} of {args.stock} units, oversold: {'YES' if held > args.stock else 'no'}")
+
+        paid, cancelled = won[::2], won[1::2]
+        await asyncio.gather(*(convert_reservation(db, order_id) for order_id in paid))
+        await asyncio.gather(*(release_reservation(db, order_id) for order_id in cancelled))
+        product = await load_product()
+        expected_stock = args.stock - len(paid) * args.quantity
+        consistent = product["reserved_quantity"] == 0 and product["stock_quantity"] == expected_stock
+        print(
+            f"after paying {len(paid)} and cancelling {len(cancelled)}: stock {product['stock_quantity']} "
+            f"(expected {expected_stock}), reserved {product['reserved_quantity']}, "
+            f"{'consistent' if consistent else 'INCONSISTENT'}"
+        )
+    finally:
+        if not args.keep:
+            await db.client.drop_database(args.db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--quantity", type=int, default=1, help="Units per checkout")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--shards", type=int, default=0, help="Split the product's stock into this many shard counters")
+    parser.add_argument("--db", default="reservation_benchmark", help="Scratch database, dropped afterwards")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
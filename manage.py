@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import sys
+
+from app.db.database import db
+
+
+async def reconcile_reviews(args):
+    from app.libs.review_utils import rebuild_review_stats
+
+    reviewed = await rebuild_review_stats(db)
+    print(f"Rebuilt rating counters ({reviewed} products with reviews)")
+
+
+async def reconcile_reservations(args):
+    from app.libs.reservations import clear_stale_hold_tags, rebuild_reserved_quantities, rebuild_shard_reserved
+
+    changed = await rebuild_reserved_quantities(db)
+    shards = await rebuild_shard_reserved(db)
+    cleaned = await clear_stale_hold_tags(db)
+    print(
+        f"Rebuilt reserved stock counters ({changed} products and {shards} stock shards corrected, "
+        f"stale hold tags cleared from {cleaned} products)"
+    )
+
+
+async def backfill_order_names(args):
+    from app.libs.order_snapshots import backfill_order_names
+
+    updated = await backfill_order_names(db)
+    print(f"Snapshotted names into {updated} orders")
+
+
+async def stock_shards(args):
+    from bson import ObjectId
+    from app.libs.stock_shards import disable_stock_shards, enable_stock_shards, rebalance_stock_shards
+
+    product_id = ObjectId(args.product_id)
+    if args.disable:
+        done = await disable_stock_shards(db, product_id)
+        print("Stock folded back into the product" if done else "Product stock is not sharded or held by checkouts")
+    elif args.rebalance:
+        print(f"Moved {await rebalance_stock_shards(db, product_id)} units between shards")
+    else:
+        done = await enable_stock_shards(db, product_id, args.shards)
+        print(f"Stock split into {args.shards} shards" if done else "Product not found, already sharded or held by checkouts")
+
+
+def stock_shards_arguments(parser):
+    parser.add_argument("product_id")
+    parser.add_argument("--shards", type=int, default=8, help="Number of shard counters (default 8)")
+    parser.add_argument("--disable", action="store_true", help="Fold the shards back into the product document")
+    parser.add_argument("--rebalance", action="store_true", help="Even out available units across the shards")
+
+
+async def ensure_indexes(args):
+    from app.db.indexes import ensure_indexes
+
+    errors = await ensure_indexes(db)
+    for collection_name, error in errors.items():
+        print(f"{collection_name}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+    print("Indexes are up to date")
+
+
+async def check_indexes(args):
+    from app.db.indexes import index_report
+
+    report = await index_report(db)
+    for collection_name, diff in report.items():
+        for kind, names in diff.items():
+            for name in names:
+                print(f"{collection_name}: {kind} {name}")
+    if any(diff["missing"] or diff["mismatched"] for diff in report.values()):
+        sys.exit(1)
+    if not report:
+        print("Indexes match the registry")
+
+
+async def export_onnx(args):
+    from app.core.config import settings
+    from app.libs.embeddings import export_onnx
+
+    out_dir = args.out_dir or settings.EMBEDDING_ONNX_DIR
+    export_onnx(settings.EMBEDDING_MODEL, settings.EMBEDDING_CHECKPOINT, out_dir, quantize=not args.no_quantize)
+    print(f"Exported {settings.EMBEDDING_MODEL} ({settings.EMBEDDING_CHECKPOINT}) to {out_dir}")
+
+
+def export_onnx_arguments(parser):
+    parser.add_argument("--out-dir", help="Output directory (defaults to EMBEDDING_ONNX_DIR)")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 quantized variant")
+
+
+async def refresh_related(args):
+    from app.libs.related_products import refresh_stale_related_products
+
+    refreshed = await refresh_stale_related_products(db, max_age_seconds=0 if args.all else None)
+    print(f"Refreshed related products for {refreshed} products")
+
+
+def refresh_related_arguments(parser):
+    parser.add_argument("--all", action="store_true", help="Refresh every product, not only stale ones")
+
+
+async def index_jobs(args):
+    from app.libs.indexing import index_job_counts, requeue_dead_index_jobs
+
+    if args.retry_dead:
+        print(f"Requeued {await requeue_dead_index_jobs(db)} dead index jobs")
+    for job_status, count in sorted((await index_job_counts(db)).items()):
+        print(f"{job_status}: {count}")
+
+
+def index_jobs_arguments(parser):
+    parser.add_argument("--retry-dead", action="store_true", help="Requeue dead-lettered jobs")
+
+
+async def reindex(args):
+    from app.libs.reindex import FULL, INCREMENTAL, reindex_catalog
+
+    state = await reindex_catalog(
+        db,
+        mode=INCREMENTAL if args.incremental else FULL,
+        restart=args.restart,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    print(f"Reindexed {state['processed']} products ({state['failed']} queued for retry)")
+
+
+def reindex_arguments(parser):
+    parser.add_argument("--incremental", action="store_true", help="Only products updated since the last completed run")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted run")
+    parser.add_argument("--batch-size", type=int, help="Products embedded per batch (defaults to REINDEX_BATCH_SIZE)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent image downloads (defaults to REINDEX_DOWNLOAD_CONCURRENCY)")
+
+
+COMMANDS = {
+    "reconcile-reviews": (reconcile_reviews, "Rebuild product rating counters from the reviews collection", None),
+    "reconcile-reservations": (reconcile_reservations, "Rebuild product and stock shard reserved counters from active reservations", None),
+    "backfill-order-names": (backfill_order_names, "Store product, merchant and user names on orders placed without them", None),
+    "stock-shards": (stock_shards, "Split a hot product's stock across shard counters", stock_shards_arguments),
+    "ensure-indexes": (ensure_indexes, "Create the indexes declared in app/db/indexes.py", None),
+    "check-indexes": (check_indexes, "Report missing, extra and mismatched indexes", None),
+    "export-onnx": (export_onnx, "Export the OpenCLIP encoders to ONNX (fp32 and int8)", export_onnx_arguments),
+    "refresh-related": (refresh_related, "Recompute stored related products", refresh_related_arguments),
+    "index-jobs": (index_jobs, "Show product indexing queue counts", index_jobs_arguments),
+    "reindex": (reindex, "Re-embed the catalog into the vector store in checkpointed batches", reindex_arguments),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="E-commerce API maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, add_arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if add_arguments:
+            add_arguments(subparser)
+
+    args = parser.parse_args()
+    handler, _, _ = COMMANDS[args.command]
+    asyncio.run(handler(args))
+
+
+if __name__ == "__main__":
+    main()
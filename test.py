@@ -1,4 +1,5 @@
-from app.libs.chromadb import update_metadata
+from app.db.database import db
+from app.libs.reindex import reindex_catalog
 import asyncio
 
-asyncio.run(update_metadata())
\ No newline at end of file
+asyncio.run(reindex_catalog(db))